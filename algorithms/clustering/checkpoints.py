@@ -0,0 +1,111 @@
+import hashlib
+import json
+import os
+import pickle
+
+# The version of the checkpoint format, changing it invalidates all the existing checkpoints
+CHECKPOINT_VERSION = 1
+
+
+class Checkpoints(object):
+    """
+    A class used to persist the outputs of the stages of CorrelationClustering.find_matches, so that a run can resume
+    from the last completed stage. Every output is saved under a key computed from the fingerprint of the input data,
+    the parameters of the stage and the key of the stage it depends on, so a checkpoint is only reused for the exact
+    same computation.
+
+    Attributes
+    ----------
+    path : str
+        the folder of the checkpoint files
+
+    Methods
+    -------
+    key(stage: str, parent: str, parameters: dict)
+        Returns the key of a stage output
+
+    load(stage: str, key: str)
+        Returns the saved output of a stage or None
+
+    save(stage: str, key: str, value)
+        Saves the output of a stage
+
+    run(stage: str, parent: str, parameters: dict, function, *args)
+        Loads the output of a stage if it was saved, otherwise computes and saves it
+    """
+    def __init__(self, path: str):
+        """
+        Parameters
+        ----------
+        path : str
+            the folder of the checkpoint files
+        """
+        self.path = path
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+    @staticmethod
+    def key(stage: str, parent: str, parameters: dict):
+        """
+        Returns the key of a stage output
+
+        Parameters
+        ----------
+        stage : str
+            the name of the stage
+        parent : str
+            the key of the stage it depends on or the fingerprint of the input data
+        parameters : dict
+            the parameters that change the output of the stage
+        """
+        content = json.dumps([CHECKPOINT_VERSION, stage, parent, parameters], sort_keys=True, default=str)
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    def __file(self, stage: str, key: str):
+        return os.path.join(self.path, stage + '-' + key[:32] + '.pkl')
+
+    def load(self, stage: str, key: str):
+        """Returns the saved output of a stage or None if it was not saved"""
+        if not os.path.exists(self.__file(stage, key)):
+            return None
+        with open(self.__file(stage, key), 'rb') as pkl_file:
+            checkpoint = pickle.load(pkl_file)
+        if checkpoint['version'] != CHECKPOINT_VERSION or checkpoint['key'] != key:
+            return None
+        return checkpoint['value']
+
+    def save(self, stage: str, key: str, value):
+        """Saves the output of a stage, writing a temporary file first so that a crash never leaves half a file"""
+        tmp_file = self.__file(stage, key) + '.tmp'
+        with open(tmp_file, 'wb') as output:
+            pickle.dump({'version': CHECKPOINT_VERSION, 'key': key, 'value': value}, output, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, self.__file(stage, key))
+
+    def run(self, stage: str, parent: str, parameters: dict, function, *args):
+        """
+        Loads the output of a stage if it was saved, otherwise computes it with function(*args) and saves it
+
+        Parameters
+        ----------
+        stage : str
+            the name of the stage
+        parent : str
+            the key of the stage it depends on or the fingerprint of the input data
+        parameters : dict
+            the parameters that change the output of the stage
+        function : callable
+            the function that computes the output of the stage
+
+        Returns
+        -------
+        tuple
+            the output of the stage and its key
+        """
+        key = self.key(stage, parent, parameters)
+        value = self.load(stage, key)
+        if value is None:
+            value = function(*args)
+            self.save(stage, key, value)
+        else:
+            print("Resuming ", stage, " from checkpoint")
+        return value, key
@@ -1,5 +1,6 @@
 import numpy as np
-import pickle
+
+from algorithms.clustering.global_ranks import get_rank_index
 
 
 class Column(object):
@@ -13,7 +14,7 @@ class Column(object):
     __name : str
         the name of the column
     data : list
-        the data contained in the column
+        the data contained in the column, None if the column was created from its ranks
     __data_type : str
         the data type of the column
     quantiles : int
@@ -25,6 +26,10 @@ class Column(object):
 
     Methods
     -------
+    from_ranks(name: str, ranks: ndarray, source_name: str, data_type: str, quantiles: int, cardinality: int,
+               size: int)
+        Creates a column from the global ranks of its data without keeping the data
+
     get_histogram()
         Returns the quantile histogram of the column
 
@@ -65,6 +70,39 @@ class Column(object):
         self.size = len(data)
         self.quantile_histogram = None
 
+    @classmethod
+    def from_ranks(cls, name: str, ranks: np.ndarray, source_name: str, data_type: str, quantiles: int,
+                   cardinality: int, size: int):
+        """
+        Parameters
+        ----------
+        name : str
+            The name of the column
+        ranks : ndarray
+            The sorted global ranks of the column's data
+        source_name : str
+            The name of the table
+        data_type: str
+            The data type of the column
+        quantiles: int
+            The number of quantiles of the column's quantile histogram
+        cardinality: int
+            The number of distinct values of the column
+        size: int
+            The number of data instances of the column
+        """
+        column = cls.__new__(cls)
+        column.__long_name = source_name + '__' + name
+        column.__name = name
+        column.data = None
+        column.__data_type = data_type
+        column.quantiles = quantiles
+        column.ranks = ranks
+        column.cardinality = cardinality
+        column.size = size
+        column.quantile_histogram = None
+        return column
+
     def get_histogram(self):
         """Returns the quantile histogram of the column"""
         return self.quantile_histogram
@@ -87,7 +125,5 @@ class Column(object):
 
     @staticmethod
     def get_global_ranks(column: list):
-        with open('cache/global_ranks/ranks.pkl', 'rb') as pkl_file:
-            global_ranks: dict = pickle.load(pkl_file)
-            ranks = np.array(sorted([global_ranks[x] for x in column]))
-            return ranks
+        """Returns the sorted global ranks of the column's data"""
+        return np.sort(get_rank_index().lookup(column))
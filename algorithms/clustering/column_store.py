@@ -0,0 +1,210 @@
+import hashlib
+import json
+import os
+import pickle
+
+import numpy as np
+from numpy import ndarray
+
+from algorithms.clustering.quantile_histogram.histogram import QuantileHistogram
+
+COLUMN_STORE_DIR = 'cache/column_store'
+
+# The arrays of a column store, saved as <name>.npy files
+COLUMN_STORE_ARRAYS = ('ranks', 'offsets', 'sizes', 'bucket_boundaries', 'bucket_values')
+
+
+class ColumnStore(object):
+    """
+    A class used to hold the ranks and the quantile histograms of all the columns in contiguous arrays, so that the
+    EMD computations can read them by index instead of unpickling column_model.Column objects
+
+    Attributes
+    ----------
+    names : list(str)
+        the compound column names (table_name + '__' + column_name)
+    ranks : ndarray
+        the sorted ranks of all the columns concatenated
+    offsets : ndarray
+        the ranks of the column i are ranks[offsets[i]:offsets[i + 1]]
+    sizes : ndarray
+        the sizes of the columns used to normalize their histograms
+    bucket_boundaries : ndarray
+        a (columns, quantiles, 2) array with the bucket boundaries of the column histograms
+    bucket_values : ndarray
+        a (columns, quantiles) array with the bucket values of the column histograms
+    path : str
+        the folder the store was saved in or loaded from, None if it is only in memory
+
+    Methods
+    -------
+    from_columns(columns: list)
+        Creates a store from column_model.Column objects
+
+    from_cache(names: list)
+        Creates a store by loading every cached column once
+
+    load(path: str, mmap_mode: str)
+        Loads a store saved with save, optionally memory-mapping its arrays
+
+    save(path: str)
+        Saves the store as .npy array files
+
+    index(name: str)
+        Returns the index of a column
+
+    get_name(i: int)
+        Returns the name of the column i
+
+    get_ranks(i: int)
+        Returns the sorted ranks of the column i
+
+    get_size(i: int)
+        Returns the size of the column i
+
+    get_histogram(i: int)
+        Returns the quantile histogram of the column i
+
+    count_in_range(low: float, high: float)
+        Returns how many ranks of every column are within [low, high]
+
+    fingerprint()
+        Returns a hash of the names, ranks and histograms of the columns
+
+    column_fingerprint(i: int)
+        Returns a hash of the ranks and the histogram of the column i
+    """
+    def __init__(self, names: list, ranks: ndarray, offsets: ndarray, sizes: ndarray, bucket_boundaries: ndarray,
+                 bucket_values: ndarray):
+        self.names = list(names)
+        self.ranks = ranks
+        self.offsets = offsets
+        self.sizes = sizes
+        self.bucket_boundaries = bucket_boundaries
+        self.bucket_values = bucket_values
+        self.path = None
+        self.__indexes = {name: i for i, name in enumerate(self.names)}
+        self.__keys = None
+        self.__stride = 1.0
+
+    def __len__(self):
+        return len(self.names)
+
+    @classmethod
+    def from_columns(cls, columns: list):
+        """
+        Parameters
+        ----------
+        columns : list(Column)
+            the columns with their quantile histograms already computed
+        """
+        names = [column.get_long_name() for column in columns]
+        lengths = [len(column.ranks) for column in columns]
+        offsets = np.concatenate(([0], np.cumsum(lengths))).astype(np.int64)
+        ranks = np.concatenate([column.ranks for column in columns]) if columns else np.empty(0)
+        sizes = np.array([column.size for column in columns], dtype=np.int64)
+        bucket_boundaries = np.array([column.get_histogram().bucket_boundaries for column in columns])
+        bucket_values = np.array([column.get_histogram().get_values for column in columns])
+        return cls(names, ranks, offsets, sizes, bucket_boundaries, bucket_values)
+
+    @classmethod
+    def from_cache(cls, names: list):
+        """
+        Parameters
+        ----------
+        names : list(str)
+            the names of the columns cached in cache/<name>.pkl
+        """
+        columns = list()
+        for name in names:
+            with open('cache/' + name + '.pkl', 'rb') as pkl_file:
+                columns.append(pickle.load(pkl_file))
+        return cls.from_columns(columns)
+
+    @classmethod
+    def load(cls, path: str, mmap_mode: str = 'r'):
+        """
+        Parameters
+        ----------
+        path : str
+            the folder the store was saved in
+        mmap_mode : str, optional
+            the numpy.load memory-map mode of the arrays, None reads them in memory (default is 'r')
+        """
+        with open(os.path.join(path, 'names.json'), 'r') as fp:
+            names = json.load(fp)
+        store = cls(names, *[np.load(os.path.join(path, name + '.npy'), mmap_mode=mmap_mode)
+                             for name in COLUMN_STORE_ARRAYS])
+        store.path = path
+        return store
+
+    def save(self, path: str = COLUMN_STORE_DIR):
+        """
+        Parameters
+        ----------
+        path : str, optional
+            the folder to save the store in (default is cache/column_store)
+        """
+        if not os.path.exists(path):
+            os.makedirs(path)
+        # write new files instead of overwriting the ones that other stores might have memory-mapped
+        with open(os.path.join(path, 'names.json.tmp'), 'w') as fp:
+            json.dump(self.names, fp)
+        for name in COLUMN_STORE_ARRAYS:
+            np.save(os.path.join(path, name + '.tmp.npy'), getattr(self, name))
+        for name in COLUMN_STORE_ARRAYS:
+            os.replace(os.path.join(path, name + '.tmp.npy'), os.path.join(path, name + '.npy'))
+        os.replace(os.path.join(path, 'names.json.tmp'), os.path.join(path, 'names.json'))
+        self.path = path
+
+    def index(self, name: str):
+        """Returns the index of a column"""
+        return self.__indexes[name]
+
+    def get_name(self, i: int):
+        """Returns the name of the column i"""
+        return self.names[i]
+
+    def get_ranks(self, i: int):
+        """Returns the sorted ranks of the column i"""
+        return self.ranks[self.offsets[i]:self.offsets[i + 1]]
+
+    def get_size(self, i: int):
+        """Returns the size of the column i"""
+        return int(self.sizes[i])
+
+    def get_histogram(self, i: int):
+        """Returns the quantile histogram of the column i"""
+        return QuantileHistogram.from_buckets(self.names[i], self.bucket_boundaries[i], self.bucket_values[i],
+                                              self.get_size(i))
+
+    def count_in_range(self, low: float, high: float):
+        """
+        Returns how many ranks of every column are within [low, high] with two binary searches over all the columns.
+        The ranks of the column i are shifted by i * (max rank + 1), which sorts all the columns in one array.
+        """
+        if self.__keys is None:
+            if len(self.ranks) > 0:
+                self.__stride = float(np.max(self.ranks)) + 1
+            self.__keys = np.repeat(np.arange(len(self)) * self.__stride, np.diff(self.offsets)) + self.ranks
+        shifts = np.arange(len(self)) * self.__stride
+        return np.searchsorted(self.__keys, shifts + high, side='right') - \
+            np.searchsorted(self.__keys, shifts + low, side='left')
+
+    def fingerprint(self):
+        """Returns a hash of the names, ranks and histograms of the columns, which changes if any column changes"""
+        digest = hashlib.sha256(json.dumps(self.names).encode('utf-8'))
+        for name in COLUMN_STORE_ARRAYS:
+            array = np.ascontiguousarray(getattr(self, name))
+            digest.update(str((name, array.dtype.str, array.shape)).encode('utf-8'))
+            digest.update(array.tobytes())
+        return digest.hexdigest()
+
+    def column_fingerprint(self, i: int):
+        """Returns a hash of the ranks and the histogram of the column i, which changes if the column changes"""
+        digest = hashlib.sha256(str(self.get_size(i)).encode('utf-8'))
+        for array in (self.get_ranks(i), self.bucket_boundaries[i], self.bucket_values[i]):
+            array = np.ascontiguousarray(array, dtype=np.float64)
+            digest.update(str(array.shape).encode('utf-8'))
+            digest.update(array.tobytes())
+        return digest.hexdigest()
@@ -1,3 +1,5 @@
+import os
+import pickle
 import timeit
 import json
 from pandas import DataFrame
@@ -5,7 +7,11 @@ from definitions import ROOT_DIR
 import re
 
 import algorithms.clustering.discovery as discovery
-from algorithms.clustering.utils import process_columns
+from algorithms.clustering.checkpoints import Checkpoints
+from algorithms.clustering.column_store import ColumnStore, COLUMN_STORE_DIR
+from algorithms.clustering.global_ranks import update_global_ranks
+from algorithms.clustering.histogram_cache import HistogramCache
+from algorithms.clustering.utils import process_columns, process_value_counts
 
 
 class CorrelationClustering:
@@ -21,17 +27,35 @@ class CorrelationClustering:
         the global threshold described in [1]
     columns : list(str)
         a list with all the compound column names (table_name + '__' + column_name)
+    emd_backend : str
+        the EMD engine, one of emd_utils.EMD_BACKENDS
+    prune : bool
+        if true skip the column combinations whose EMD is provably above threshold1
+    solver : str
+        the correlation clustering solver, one of correlation_solvers.SOLVERS
+    checkpoint_dir : str
+        the folder of the checkpoints of the find_matches stages, None disables them
+    incremental_state : str
+        the file with the EMD matrix and the attribute clusters of the last find_matches, None disables the
+        incremental mode
+    histogram_cache : HistogramCache
+        the content-keyed cache of the column ranks and histograms, None disables it
 
     Methods
     -------
-    add_data(data, source_name, pool)
-        Returns the quantile histogram of the column
+    add_data(data, source_name)
+        Processes a table into columns and stores them as pickle files
 
-    find_matches(pool)
-        Returns the column name
+    add_value_counts(columns, source_name)
+        Processes the value counts of a table's columns into columns and stores them as pickle files
+
+    find_matches(processes, chunk_size)
+        Computes the distribution clusters and then the attribute clusters
 
     """
-    def __init__(self, quantiles: int, threshold1: float, threshold2: float):
+    def __init__(self, quantiles: int, threshold1: float, threshold2: float, emd_backend: str = 'pyemd',
+                 prune: bool = False, solver: str = 'auto', checkpoint_dir: str = None,
+                 incremental_state: str = None, histogram_cache: HistogramCache = None):
         """
         Parameters
         ----------
@@ -39,11 +63,40 @@ class CorrelationClustering:
             The number of quantiles of the column's quantile histogram
         threshold : float
             The global threshold described in [1]
+        emd_backend : str, optional
+            The EMD engine, one of emd_utils.EMD_BACKENDS (default is 'pyemd')
+        prune : bool, optional
+            If true skip the column combinations whose EMD is provably above threshold1 (default is False)
+        solver : str, optional
+            The correlation clustering solver, one of correlation_solvers.SOLVERS (default is 'auto')
+        checkpoint_dir : str, optional
+            The folder where find_matches saves the output of every stage and resumes from, None disables the
+            checkpoints (default is None)
+        incremental_state : str, optional
+            The file where find_matches saves its EMD matrix and attribute clusters. If it exists the columns of the
+            last run are kept, the new data only needs the EMD of the pairs with a new or changed column and only the
+            changed distribution clusters are solved again. The values that are not in the global ranks are inserted
+            without changing the existing ranks; regenerating the global ranks changes every column and so
+            recomputes everything. None disables the incremental mode (default is None)
+        histogram_cache : HistogramCache, optional
+            The cache that keeps the ranks and the histograms of the columns by content, so that unchanged columns
+            are not processed again, None disables it (default is None)
         """
         self.quantiles = quantiles
         self.threshold1 = threshold1
         self.threshold2 = threshold2
+        self.emd_backend = emd_backend
+        self.prune = prune
+        self.solver = solver
+        self.checkpoint_dir = checkpoint_dir
+        self.incremental_state = incremental_state
+        self.histogram_cache = histogram_cache
         self.columns = list()
+        self.__state = None
+        if incremental_state is not None and os.path.exists(incremental_state):
+            with open(incremental_state, 'rb') as pkl_file:
+                self.__state = pickle.load(pkl_file)
+            self.columns = list(self.__state['columns'])
 
     def add_data(self, data: DataFrame, source_name: str):
         """
@@ -58,27 +111,85 @@ class CorrelationClustering:
         pool: multiprocessing.Pool
             the process pool that will be used in the pre-processing of the table's columns
         """
+        if self.incremental_state is not None:
+            update_global_ranks({value for column_name in data.columns for value in data[column_name] if value != ''})
+
         for column_name in data.columns:
-            process_columns((column_name, data[column_name], source_name, data.dtypes[column_name], self.quantiles))
+            process_columns((column_name, data[column_name], source_name, data.dtypes[column_name], self.quantiles,
+                             self.histogram_cache))
 
-        self.columns = self.columns + list(map(lambda name: source_name + '__' + name, data.columns))
+        self.__add_columns(list(map(lambda name: source_name + '__' + name, data.columns)))
 
-    def find_matches(self):
+    def add_value_counts(self, columns: dict, source_name: str):
+        """
+        Processes the value counts of a table's columns into column_model_scale.Column objects and stores them as
+        pickle files, without needing the table in memory
+
+        Parameters
+        ---------
+        columns : dict
+            the value counts and data type of every column of the table, as computed by
+            utils.stream_column_counts
+        source_name : str
+            the name of the table
+        """
+        if self.incremental_state is not None:
+            update_global_ranks({value for counts, _ in columns.values() for value in counts.index if value != ''})
+
+        for column_name, (counts, data_type) in columns.items():
+            process_value_counts((column_name, counts, source_name, data_type, self.quantiles, self.histogram_cache))
+
+        self.__add_columns(list(map(lambda name: source_name + '__' + name, columns.keys())))
+
+    def __add_columns(self, names: list):
+        """Adds the column names, the ones that are already added (e.g. a table added again) are updated in place"""
+        added = set(self.columns)
+        self.columns = self.columns + [name for name in names if name not in added]
+
+    def find_matches(self, processes: int = 1, chunk_size: int = None, draw: bool = False):
         """
         "Main" function of [1] that will calculate first the distribution clusters and then the attribute clusters
 
         Parameters
         ---------
-        pool: multiprocessing.Pool
-            the process pool that will be used in the algorithms 1, 2 and 3 of [1]
+        processes: int, optional
+            the number of worker processes that compute the EMD in the algorithm 2 of [1] and then process the
+            distribution clusters, None uses all the cores (default is 1)
         chunk_size: int, optional
-            the number of chunks of each job process (default let the framework decide)
+            the number of columns whose combinations are sent to a worker at once (default splits the work in 4
+            chunks per worker)
+        draw: bool, optional
+            if true draw the graphs of the distribution and the attribute clusters with networkx (default is False)
         """
+        if self.histogram_cache is not None:
+            print("Histogram cache: ", self.histogram_cache.stats())
+
         start = timeit.default_timer()
 
+        # the store is saved once and memory-mapped, by this process and by the workers that compute the EMD
+        ColumnStore.from_cache(self.columns).save(COLUMN_STORE_DIR)
+        store = ColumnStore.load(COLUMN_STORE_DIR)
+        checkpoints = Checkpoints(self.checkpoint_dir) if self.checkpoint_dir is not None else None
+
         print("Compute distribution clusters ...\n")
 
-        connected_components = discovery.compute_distribution_clusters(self.columns, self.threshold1, self.quantiles)
+        emd_parameters = {'quantiles': self.quantiles, 'emd_backend': self.emd_backend, 'prune': self.prune,
+                          'threshold1': self.threshold1 if self.prune else None}
+        attribute_parameters = {'threshold2': self.threshold2, 'solver': self.solver}
+        previous_emd, previous_attributes = self.__previous_state(emd_parameters, attribute_parameters)
+
+        # hashing all the ranks is only needed to key the checkpoints
+        fingerprint = store.fingerprint() if checkpoints is not None else None
+        A, key = self.__run_stage(checkpoints, 'emd_matrix', fingerprint,
+                                  dict(emd_parameters, columns=self.columns), discovery.compute_emd_matrix,
+                                  self.columns, self.threshold1, self.quantiles, self.emd_backend, processes,
+                                  chunk_size, store, self.prune, previous_emd)
+
+        connected_components, key = self.__run_stage(checkpoints, 'distribution_clusters', key,
+                                                     {'threshold1': self.threshold1},
+                                                     discovery.compute_distribution_clusters, self.columns,
+                                                     self.threshold1, self.quantiles, self.emd_backend, processes,
+                                                     chunk_size, store, self.prune, draw, A)
 
         stop = timeit.default_timer()
 
@@ -89,25 +200,18 @@ class CorrelationClustering:
 
         start = timeit.default_timer()
 
-        print("Compute attributes ... \n")
-        all_attributes = list()
-        for components in connected_components:
-            if len(components) > 1:
-                edges = discovery.compute_attributes(list(components), self.threshold2, self.quantiles)
-                all_attributes.append((list(components), edges))
-
-        print(all_attributes)
-
-        stop = timeit.default_timer()
-
-        print('Time: ', stop - start)
-
-        start = timeit.default_timer()
+        print("Compute attributes and solve linear program ... \n")
+        distribution_clusters = [list(components) for components in connected_components if len(components) > 1]
+        # every distribution cluster is also saved on its own, so a crash only loses the unfinished ones
+        cluster_key = Checkpoints.key('attribute_cluster', key, attribute_parameters) if checkpoints is not None \
+            else None
+        results, key = self.__run_stage(checkpoints, 'attribute_clusters', key, attribute_parameters,
+                                        discovery.compute_attribute_clusters, distribution_clusters,
+                                        self.threshold2, self.quantiles, self.emd_backend, self.solver, processes,
+                                        store, previous_attributes, checkpoints, cluster_key)
 
-        print("Solve linear program ... \n")
-        results = list()
-        for components, edges in all_attributes:
-            results.append(discovery.correlation_clustering_pulp(components, edges))
+        if self.incremental_state is not None:
+            self.__save_state(store, A, distribution_clusters, results, emd_parameters, attribute_parameters)
 
         stop = timeit.default_timer()
 
@@ -117,7 +221,7 @@ class CorrelationClustering:
 
         print("Extract clusters ... \n")
 
-        attribute_clusters = discovery.process_correlation_clustering_result(results, self.columns)
+        attribute_clusters = discovery.process_correlation_clustering_result(results, self.columns, draw)
 
         stop = timeit.default_timer()
 
@@ -127,6 +231,50 @@ class CorrelationClustering:
         self.write_clusters_to_json(attribute_clusters,
                                     'Attribute_Clusters(Matches).json')
 
+    def __previous_state(self, emd_parameters: dict, attribute_parameters: dict):
+        """
+        Returns the EMD matrix and the attribute clusters of the last run in the format of
+        discovery.compute_emd_matrix and discovery.compute_attribute_clusters, or None if they were computed with
+        other parameters
+        """
+        if self.__state is None or self.__state['emd_parameters'] != emd_parameters:
+            return None, None
+        previous_emd = (self.__state['columns'], self.__state['fingerprints'], self.__state['emd_matrix'])
+        if self.__state['attribute_parameters'] != attribute_parameters:
+            return previous_emd, None
+        return previous_emd, self.__state['attributes']
+
+    def __save_state(self, store: ColumnStore, A, distribution_clusters: list, results: list, emd_parameters: dict,
+                     attribute_parameters: dict):
+        """Saves the EMD matrix and the attribute clusters of the run for the next incremental run"""
+        attributes = dict()
+        for DC, pairs in zip(distribution_clusters, results):
+            attributes[discovery.distribution_cluster_key(DC, store)] = [(store.get_name(u), store.get_name(v))
+                                                                        for u, v in pairs]
+        self.__state = {'columns': list(self.columns),
+                        'fingerprints': [store.column_fingerprint(store.index(name)) for name in self.columns],
+                        'emd_matrix': A,
+                        'emd_parameters': emd_parameters,
+                        'attributes': attributes,
+                        'attribute_parameters': attribute_parameters}
+        with open(self.incremental_state + '.tmp', 'wb') as output:
+            pickle.dump(self.__state, output, pickle.HIGHEST_PROTOCOL)
+        os.replace(self.incremental_state + '.tmp', self.incremental_state)
+
+    @staticmethod
+    def __run_stage(checkpoints: Checkpoints, stage: str, parent: str, parameters: dict, function, *args):
+        """
+        Runs a stage of find_matches through the checkpoints, or directly if they are disabled
+
+        Returns
+        -------
+        tuple
+            the output of the stage and its checkpoint key (None without checkpoints)
+        """
+        if checkpoints is None:
+            return function(*args), None
+        return checkpoints.run(stage, parent, parameters, function, *args)
+
     @staticmethod
     def write_clusters_to_json(clusters: list, file_name: str):
         """
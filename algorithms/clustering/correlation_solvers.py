@@ -0,0 +1,176 @@
+import numpy as np
+import pulp as plp
+from numpy import ndarray
+from scipy import sparse
+
+SOLVERS = ('auto', 'ilp', 'pivot')
+
+# The largest distribution cluster solved exactly by the auto solver, the ILP has 3 * n choose 3 triangle constraints
+EXACT_MAX_SIZE = 30
+
+# The number of random pivot orders tried by the pivot solver, the clustering with the fewest disagreements is kept
+PIVOT_ROUNDS = 10
+
+
+def pair_weights(graph: sparse.spmatrix):
+    """
+    Helper function that counts the similar edges of every vertex pair in both directions, since the attribute graph
+    of compute_attributes does not have to be symmetric. Every direction that is not similar is dissimilar, so a pair
+    has 2 - weight dissimilar edges.
+
+    Parameters
+    ---------
+    graph : scipy.sparse.spmatrix
+        the boolean adjacency matrix of the similar vertexes
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        the symmetric matrix with the number (1 or 2) of similar edges of every pair, without the diagonal
+    """
+    similar = sparse.csr_matrix(graph, dtype=np.int64)
+    weights = (similar + similar.T).tocsr()
+    weights.setdiag(0)
+    weights.eliminate_zeros()
+    return weights
+
+
+def disagreements(labels: ndarray, weights: sparse.csr_matrix):
+    """
+    The objective of correlation clustering: the similar edges between clusters plus the dissimilar edges inside them
+
+    Parameters
+    ---------
+    labels : ndarray
+        the cluster label of every vertex
+    weights : scipy.sparse.csr_matrix
+        the number of similar edges of every pair, as computed by pair_weights
+    """
+    upper = sparse.triu(weights, 1).tocoo()
+    similar_inside = int(np.sum(upper.data[labels[upper.row] == labels[upper.col]]))
+    _, sizes = np.unique(labels, return_counts=True)
+    pairs_inside = int(np.sum(sizes * (sizes - 1) // 2))
+    return (int(np.sum(upper.data)) - similar_inside) + (2 * pairs_inside - similar_inside)
+
+
+def ilp_correlation_clustering(weights: sparse.csr_matrix):
+    """
+    Solves correlation clustering exactly with an integer program over the unordered vertex pairs. The variable x_ij
+    is 1 if the vertexes i and j are in different clusters, and the triangle inequalities make the clustering
+    transitive.
+
+    Parameters
+    ---------
+    weights : scipy.sparse.csr_matrix
+        the number of similar edges of every pair, as computed by pair_weights
+
+    Returns
+    -------
+    ndarray
+        the cluster label of every vertex
+    """
+    n = weights.shape[0]
+    positive = weights.toarray()
+    opt_model = plp.LpProblem(name="MIP_Model", sense=plp.LpMinimize)
+
+    x_vars = {(i, j): plp.LpVariable(cat=plp.LpBinary, name="x_{0}_{1}".format(i, j))
+              for i in range(n) for j in range(i + 1, n)}
+
+    for i in range(n):
+        for j in range(i + 1, n):
+            for k in range(j + 1, n):
+                opt_model += x_vars[i, k] <= x_vars[i, j] + x_vars[j, k]
+                opt_model += x_vars[i, j] <= x_vars[i, k] + x_vars[j, k]
+                opt_model += x_vars[j, k] <= x_vars[i, j] + x_vars[i, k]
+
+    opt_model.setObjective(plp.lpSum(positive[i, j] * x + (2 - positive[i, j]) * (1 - x)
+                                     for (i, j), x in x_vars.items()))
+
+    opt_model.solve()
+
+    labels = np.arange(n)
+    for i in range(n):
+        if labels[i] == i:
+            for j in range(i + 1, n):
+                if x_vars[i, j].varValue is not None and round(x_vars[i, j].varValue) == 0:
+                    labels[j] = i
+    return labels
+
+
+def pivot_correlation_clustering(weights: sparse.csr_matrix, rounds: int = PIVOT_ROUNDS, seed: int = 0):
+    """
+    Approximates correlation clustering with the pivot algorithm (KwikCluster) of Ailon et al. An unclustered vertex
+    is picked at random and forms a cluster with all the unclustered vertexes it is similar to, until every vertex is
+    clustered. The algorithm is repeated with different random orders and the clustering with the fewest
+    disagreements is kept.
+
+    A vertex is similar to another if at least one of the two edges between them is similar, which costs the same
+    as the other choice.
+
+    Parameters
+    ---------
+    weights : scipy.sparse.csr_matrix
+        the number of similar edges of every pair, as computed by pair_weights
+    rounds : int, optional
+        the number of random pivot orders (default is PIVOT_ROUNDS)
+    seed : int, optional
+        the seed of the random pivot orders (default is 0)
+
+    Returns
+    -------
+    ndarray
+        the cluster label of every vertex
+    """
+    n = weights.shape[0]
+    rng = np.random.default_rng(seed)
+    best_labels, best_cost = np.arange(n), None
+    for _ in range(rounds):
+        labels = np.full(n, -1)
+        for pivot in rng.permutation(n):
+            if labels[pivot] == -1:
+                neighbours = weights.indices[weights.indptr[pivot]:weights.indptr[pivot + 1]]
+                labels[neighbours[labels[neighbours] == -1]] = pivot
+                labels[pivot] = pivot
+        cost = disagreements(labels, weights)
+        if best_cost is None or cost < best_cost:
+            best_labels, best_cost = labels, cost
+    return best_labels
+
+
+def solve_correlation_clustering(vertexes: list, graph: sparse.spmatrix, solver: str = 'auto',
+                                 max_exact_size: int = EXACT_MAX_SIZE):
+    """
+    Clusters the attribute graph of a distribution cluster with the chosen solver
+
+    Parameters
+    ---------
+    vertexes : list
+        the vertexes of the attribute graph
+    graph : scipy.sparse.spmatrix
+        the attribute graph as a boolean adjacency matrix of the similar vertexes, as computed by
+        discovery.compute_attributes
+    solver : str, optional
+        one of SOLVERS, 'auto' solves the graphs of up to max_exact_size vertexes exactly and the larger ones with
+        the pivot algorithm (default is 'auto')
+    max_exact_size : int, optional
+        the largest graph the 'auto' solver solves exactly (default is EXACT_MAX_SIZE)
+
+    Returns
+    -------
+    ndarray
+        a (pairs, 2) array with pairs of vertex positions placed in the same cluster, one pair that links every
+        vertex to the first vertex of its cluster
+    """
+    if solver not in SOLVERS:
+        raise ValueError("Unknown correlation clustering solver '{}', expected one of {}".format(solver, SOLVERS))
+    if solver == 'auto':
+        solver = 'ilp' if len(vertexes) <= max_exact_size else 'pivot'
+    weights = pair_weights(graph)
+    if solver == 'ilp':
+        labels = ilp_correlation_clustering(weights)
+    else:
+        labels = pivot_correlation_clustering(weights)
+
+    _, first, inverse = np.unique(labels, return_index=True, return_inverse=True)
+    pairs = np.column_stack((first[inverse], np.arange(len(labels))))
+    return pairs[pairs[:, 0] != pairs[:, 1]]
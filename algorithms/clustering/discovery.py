@@ -1,14 +1,21 @@
+import os
+from multiprocessing import Pool
+
 import numpy as np
-import networkx as nx
-import pulp as plp
-from tqdm import tqdm
-import re
+from numpy import ndarray
+from scipy import sparse
 
-from algorithms.clustering.utils import transform_dict, process_emd, column_combinations, \
-    parallel_cutoff_threshold, cuttoff_column_generator, compute_cutoff_threshold
+import algorithms.clustering.utils as utils
+from algorithms.clustering.checkpoints import Checkpoints
+from algorithms.clustering.column_store import ColumnStore
+from algorithms.clustering.disjoint_set import DisjointSet
+from algorithms.clustering.correlation_solvers import solve_correlation_clustering
+from algorithms.clustering.utils import compute_emd, column_combinations, cutoff_edges, prune_combinations
 
 
-def compute_distribution_clusters(columns: list, threshold: float, quantiles: int = 256):
+def compute_distribution_clusters(columns: list, threshold: float, quantiles: int = 256, emd_backend: str = 'pyemd',
+                                  processes: int = 1, chunk_size: int = None, store: ColumnStore = None,
+                                  prune: bool = False, draw: bool = False, A: ndarray = None):
     """
     Algorithm 2 of the paper "Automatic Discovery of Attributes in Relational Databases" from M. Zhang et al. [1]. This
     algorithm captures which columns contain data with similar distributions based on the EMD distance metric.
@@ -21,31 +28,90 @@ def compute_distribution_clusters(columns: list, threshold: float, quantiles: in
         the conservative global EMD cutoff threshold described in [1]
     quantiles : int, optional
         the number of quantiles that the histograms are split on (default is 256)
+    emd_backend : str, optional
+        the EMD engine, one of emd_utils.EMD_BACKENDS (default is 'pyemd')
+    processes : int, optional
+        the number of worker processes computing the EMD, None uses all the cores (default is 1)
+    chunk_size : int, optional
+        the number of columns whose combinations are sent to a worker at once (default splits the work in 4 chunks
+        per worker)
+    store : ColumnStore, optional
+        the ranks and histograms of the columns (default loads them from the cache)
+    prune : bool, optional
+        if true skip the column combinations whose EMD is provably above the threshold (default is False)
+    draw : bool, optional
+        if true draw the graph of the distribution clusters with networkx (default is False)
+    A : ndarray, optional
+        the EMD matrix of the columns computed by compute_emd_matrix (default computes it)
 
     Returns
     -------
     list(list(str))
         a list that contains the distribution clusters that contain the column names in the cluster
     """
-    combinations = list(column_combinations(columns, quantiles, intersection=False))
+    if A is None:
+        A = compute_emd_matrix(columns, threshold, quantiles, emd_backend, processes, chunk_size, store, prune)
 
-    total = len(combinations)
+    rows, cols = cutoff_edges(A, threshold)
 
-    A: dict = transform_dict(dict(tqdm([process_emd(i) for i in combinations], total=total)))
-    print(A)
+    if draw:
+        draw_graph(columns, rows, cols)
 
-    edges_per_column = list([parallel_cutoff_threshold(j) for j in list(cuttoff_column_generator(A, columns, threshold))])
-    graph = create_graph(columns, edges_per_column)
+    return connected_components(columns, rows, cols)
 
-    nx.draw(graph)
-    # plt.show()
 
-    connected_components = list(nx.connected_components(graph))
+def compute_emd_matrix(columns: list, threshold: float, quantiles: int = 256, emd_backend: str = 'pyemd',
+                       processes: int = 1, chunk_size: int = None, store: ColumnStore = None, prune: bool = False,
+                       previous: tuple = None):
+    """
+    Computes the EMD matrix of the columns that algorithm 2 of [1] clusters, see compute_distribution_clusters for
+    the other parameters
+
+    Parameters
+    ---------
+    previous : tuple, optional
+        the (columns, column fingerprints, EMD matrix) of a previous run with the same parameters. Only the EMD of the
+        pairs with a new or changed column is computed, the rest is copied (default computes all the pairs)
+
+    Returns
+    -------
+    ndarray
+        the EMD matrix of the columns, as computed by utils.compute_emd
+    """
+    if store is None:
+        store = ColumnStore.from_cache(columns)
+
+    ids = np.array([store.index(name) for name in columns], dtype=np.int64)
+    rows = list(column_combinations(columns))
+
+    if prune:
+        total = sum(len(js) for _, js in rows)
+        rows, pruned = prune_combinations(rows, ids, store, threshold)
+        print("Pruned ", pruned, " out of ", total, " column combinations")
+
+    if previous is not None:
+        previous_columns, previous_fingerprints, previous_A = previous
+        previous_indexes = {name: i for i, name in enumerate(previous_columns)}
+        unchanged = {name for name in columns if name in previous_indexes and
+                     previous_fingerprints[previous_indexes[name]] == store.column_fingerprint(store.index(name))}
+        is_unchanged = np.array([name in unchanged for name in columns], dtype=bool)
+        rows = [(i, js[~is_unchanged[js]] if is_unchanged[i] else js) for i, js in rows]
+        rows = [(i, js) for i, js in rows if len(js) > 0]
+        print("Reusing the EMD of ", len(unchanged), " unchanged out of ", len(columns), " columns")
+
+    A = compute_emd(rows, ids, store, False, emd_backend, processes, chunk_size)
+
+    if previous is not None:
+        kept = np.array([i for i, name in enumerate(columns) if name in unchanged], dtype=np.int64)
+        previous_kept = np.array([previous_indexes[columns[i]] for i in kept], dtype=np.int64)
+        A[np.ix_(kept, kept)] = previous_A[np.ix_(previous_kept, previous_kept)]
 
-    return connected_components
+    print(A)
+    return A
 
 
-def compute_attributes(DC: list, threshold: float, quantiles: int = 256):
+def compute_attributes(DC: list, threshold: float, quantiles: int = 256, emd_backend: str = 'pyemd',
+                       processes: int = 1, chunk_size: int = None, store: ColumnStore = None, pool: Pool = None):
     """
     Algorithm 3 of the paper "Automatic Discovery of Attributes in Relational Databases" from M. Zhang et al.[1]
     This algorithm creates the attribute graph of the distribution clusters computed in algorithm 2.
@@ -58,104 +124,218 @@ def compute_attributes(DC: list, threshold: float, quantiles: int = 256):
         the conservative global EMD cutoff threshold described in [1]
     quantiles : int, optional
         ehe number of quantiles that the histograms are split on (default is 256)
+    emd_backend : str, optional
+        the EMD engine, one of emd_utils.EMD_BACKENDS (default is 'pyemd')
+    processes : int, optional
+        the number of worker processes computing the EMD, None uses all the cores (default is 1)
+    chunk_size : int, optional
+        the number of columns whose combinations are sent to a worker at once (default splits the work in 4 chunks
+        per worker)
+    store : ColumnStore, optional
+        the ranks and histograms of the columns (default loads them from the cache)
+    pool : multiprocessing.Pool, optional
+        a pool of processes processes that computes the EMD, see utils.compute_emd (default starts a new pool)
 
     Returns
     -------
-    dict
-        a dictionary that contains the attribute graph of the distribution clusters
+    scipy.sparse.csr_matrix
+        the attribute graph of the distribution cluster as a boolean adjacency matrix indexed by the position of the
+        columns in DC, the columns that are not adjacent are dissimilar
     """
 
-    combinations = list(column_combinations(DC, quantiles, intersection=True))
-
-    total = len(combinations)
-
-    I = transform_dict(dict(tqdm([process_emd(i) for i in combinations], total=total)))
+    if store is None:
+        store = ColumnStore.from_cache(DC)
 
-    GA = dict()
-    E = np.zeros((len(DC), len(DC)))
+    ids = np.array([store.index(name) for name in DC], dtype=np.int64)
+    I = compute_emd(list(column_combinations(DC)), ids, store, True, emd_backend, processes, chunk_size, pool)
 
-    for i in range(len(DC)):
-        name_i = DC[i]
+    rows, cols = cutoff_edges(I, threshold)
+    E = sparse.csr_matrix((np.ones(len(rows), dtype=np.int64), (rows, cols)), shape=(len(DC), len(DC)))
 
-        cutoff_i = compute_cutoff_threshold(I[name_i], threshold)
+    M = E + E @ E
 
-        Nc = [i['c'] for i in I[name_i] if i['e'] <= cutoff_i]
+    return (M > 0).tocsr()
 
-        for Cj in Nc:
-            E[i][DC.index(Cj)] = 1
-        GA[DC[i]] = dict()
 
-    M = E + np.dot(E, E)
-    for i in range(len(DC)):
-        for j in range(len(DC)):
-            if M[i][j] == 0:
-                GA[DC[i]][DC[j]] = -1
-            else:
-                GA[DC[i]][DC[j]] = 1
-
-    return GA
+def process_distribution_cluster(tup: tuple):
+    """
+    Computes the attribute graph of a distribution cluster (algorithm 3 of [1]), unless it is given, and clusters
+    it with the correlation clustering solver, reading the columns from the column store of the process
 
+    Parameters
+    ---------
+    tup : tuple
+        tuple containing the position of the distribution cluster and the information needed to process it
 
-def correlation_clustering_pulp(vertexes, edges):
+    Returns
+    -------
+    tuple
+        the position of the distribution cluster and the pairs of column ids (positions in the column store) that
+        the solver placed in the same cluster
+    """
+    k, DC, threshold, quantiles, emd_backend, solver, edges = tup
+    if edges is None:
+        edges = compute_attributes(DC, threshold, quantiles, emd_backend, 1, None, utils.worker_store)
+    ids = np.array([utils.worker_store.index(name) for name in DC], dtype=np.int64)
+    return k, ids[solve_correlation_clustering(DC, edges, solver)]
 
-    opt_model = plp.LpProblem(name="MIP_Model", sense=plp.LpMinimize)
 
-    set_u = vertexes
-    set_v = vertexes
-    # set_w = vertexes
+def compute_attribute_clusters(distribution_clusters: list, threshold: float, quantiles: int = 256,
+                               emd_backend: str = 'pyemd', solver: str = 'auto', processes: int = 1,
+                               store: ColumnStore = None, previous: dict = None, checkpoints: Checkpoints = None,
+                               checkpoint_key: str = None):
+    """
+    Runs process_distribution_cluster for every distribution cluster, either serially or in a process pool. The
+    distribution clusters are independent, so every process handles whole clusters and they are scheduled from the
+    largest to the smallest to balance the load. A cluster with more column combinations than the share of a worker
+    would keep one worker busy long after the others, so the EMD of such large clusters is first spread over the
+    whole pool and only their attribute graphs are solved per task. With checkpoints, the result of every distribution cluster is saved
+    as soon as it is solved, so a run that crashes only solves the remaining clusters again.
 
-    x_vars = {(i, j): plp.LpVariable(cat=plp.LpInteger, lowBound=0, upBound=1, name="{0}--{1}".format(i, j))
-              for i in set_u for j in set_v}
+    Parameters
+    ---------
+    distribution_clusters : list(list(str))
+        the distribution clusters computed in algorithm 2
+    threshold : float
+        the conservative global EMD cutoff threshold described in [1]
+    quantiles : int, optional
+        the number of quantiles that the histograms are split on (default is 256)
+    emd_backend : str, optional
+        the EMD engine, one of emd_utils.EMD_BACKENDS (default is 'pyemd')
+    solver : str, optional
+        the correlation clustering solver, one of correlation_solvers.SOLVERS (default is 'auto')
+    processes : int, optional
+        the number of worker processes, 1 runs in the current process and None uses all the cores (default is 1)
+    store : ColumnStore, optional
+        the ranks and histograms of the columns (default loads them from the cache)
+    previous : dict, optional
+        the column name pairs placed in the same cluster by a previous run with the same parameters, keyed by
+        distribution_cluster_key. The distribution clusters found in it are not solved again (default solves all)
+    checkpoints : Checkpoints, optional
+        the checkpoints of the results of the distribution clusters (default does not save them)
+    checkpoint_key : str, optional
+        the key the checkpoints of the distribution clusters depend on, e.g. the key of the distribution clusters
+        and the parameters of the attribute clusters
 
-    # constraints = {(i, j, k): plp.LpConstraint(e=x_vars[i, k],
-    #                                            sense=plp.LpConstraintLE,
-    #                                            rhs=x_vars[i, j] + x_vars[j, k],
-    #                                            name="constraint_{0}_{1}_{2}".format(i, j, k))
-    #                for i in set_u for j in set_v for k in set_w}
+    Returns
+    -------
+    list
+        the (pairs, 2) arrays of column ids placed in the same cluster, in the order of the distribution clusters
+    """
+    if store is None:
+        store = ColumnStore.from_cache([column for DC in distribution_clusters for column in DC])
+
+    results = [None] * len(distribution_clusters)
+    if previous is not None:
+        for k, DC in enumerate(distribution_clusters):
+            pairs = previous.get(distribution_cluster_key(DC, store))
+            if pairs is not None:
+                results[k] = np.array([[store.index(u), store.index(v)] for u, v in pairs],
+                                      dtype=np.int64).reshape(-1, 2)
+        print("Reusing ", sum(result is not None for result in results), " out of ", len(results),
+              " distribution clusters")
+
+    keys = [None] * len(distribution_clusters)
+    if checkpoints is not None:
+        for k, DC in enumerate(distribution_clusters):
+            keys[k] = checkpoints.key('attribute_cluster', checkpoint_key, {'columns': DC})
+            if results[k] is None:
+                results[k] = checkpoints.load('attribute_cluster', keys[k])
+        print("Resuming ", sum(result is not None for result in results), " out of ", len(results),
+              " distribution clusters from checkpoints")
+
+    order = sorted([k for k in range(len(distribution_clusters)) if results[k] is None],
+                   key=lambda k: -len(distribution_clusters[k]))
+    tasks = [(k, distribution_clusters[k], threshold, quantiles, emd_backend, solver, None) for k in order]
+
+    if processes == 1:
+        utils.init_process_emd(store)
+        for k, result in map(process_distribution_cluster, tasks):
+            results[k] = result
+            if checkpoints is not None:
+                checkpoints.save('attribute_cluster', keys[k], result)
+    else:
+        with Pool(processes, initializer=utils.init_process_emd,
+                  initargs=(utils.worker_store_argument(store),)) as pool:
+            large = large_clusters([len(distribution_clusters[k]) for k in order], processes or os.cpu_count())
+            for t in large:
+                k, DC = tasks[t][:2]
+                edges = compute_attributes(DC, threshold, quantiles, emd_backend, processes, None, store, pool)
+                tasks[t] = tasks[t][:-1] + (edges,)
+            for k, result in pool.imap_unordered(process_distribution_cluster, tasks):
+                results[k] = result
+                if checkpoints is not None:
+                    checkpoints.save('attribute_cluster', keys[k], result)
+    return results
+
+
+def large_clusters(sizes: list, processes: int):
+    """
+    Helper function that returns the positions of the distribution clusters whose column combinations are more than
+    the share of one of the processes, given their sizes from the largest to the smallest
+    """
+    combinations = np.array(sizes, dtype=np.int64) * (np.array(sizes, dtype=np.int64) - 1) // 2
+    return np.flatnonzero(combinations > combinations.sum() / processes)
 
-    sum1 = plp.lpSum(x_vars[i, j] for i in set_u for j in set_v if edges[i][j] == 1)
-    sum2 = plp.lpSum(1 - x_vars[i, j] for i in set_u for j in set_v if edges[i][j] == -1)
 
-    opt_model.setObjective(sum1 + sum2)
+def distribution_cluster_key(DC: list, store: ColumnStore):
+    """Returns a key of a distribution cluster that changes if its columns or any of their data change"""
+    return frozenset((name, store.column_fingerprint(store.index(name))) for name in DC)
 
-    opt_model.solve()
 
-    result = dict()
+def process_correlation_clustering_result(results: list, columns: list, draw: bool = False):
+    """
+    Extracts the attribute clusters from the pairs of columns that the solver placed in the same cluster
 
-    for v in opt_model.variables():
-        result[v.name] = v.varValue
+    Parameters
+    ---------
+    results : list
+        the (pairs, 2) arrays of column ids computed by compute_attribute_clusters
+    columns : list(str)
+        the columns of the database in the order of the column store
+    draw : bool, optional
+        if true draw the graph of the attribute clusters with networkx (default is False)
 
-    return result
+    Returns
+    -------
+    list(list(str))
+        a list that contains the attribute clusters
+    """
+    pairs = np.concatenate(results) if len(results) > 0 else np.empty((0, 2), dtype=np.int64)
 
+    if draw:
+        draw_graph(columns, pairs[:, 0], pairs[:, 1])
 
-def process_correlation_clustering_result(results, columns):
-    clusters = []
-    for cluster in results:
-        clusters.extend([k for (k, v) in cluster.items() if v == 0])
-    edges_per_column = []
-    for match in clusters:
-        table1, column1, table2, column2 = get_columns_tables_from_match(match)
-        edges_per_column.append([(table1+"__"+column1, table2+"__"+column2)])
+    return connected_components(columns, pairs[:, 0], pairs[:, 1])
 
-    graph = create_graph(columns, edges_per_column)
 
-    nx.draw(graph)
-    # plt.show()
+def connected_components(nodes: list, rows, cols):
+    """
+    Computes the connected components of a graph with a disjoint set over the positions of the nodes
 
-    connected_components = list(nx.connected_components(graph))
+    Parameters
+    ---------
+    nodes : list(str)
+        the nodes of the graph
+    rows : iterable
+        the positions of the first nodes of the edges
+    cols : iterable
+        the positions of the second nodes of the edges
 
-    return connected_components
+    Returns
+    -------
+    list(list(str))
+        the connected components, ordered by the position of their first node
+    """
+    components = DisjointSet(len(nodes))
+    components.union_edges(rows, cols)
+    return [[nodes[i] for i in component] for component in components.components()]
 
 
-def create_graph(nodes, edges_per_column):
+def draw_graph(nodes: list, rows, cols):
+    """Draws the graph with networkx, which is only imported when a graph is drawn"""
+    import networkx as nx
     graph = nx.Graph()
-    for node in nodes:
-        graph.add_node(node)
-    for edges in edges_per_column:
-        graph.add_edges_from(edges)
-    return graph
-
-
-def get_columns_tables_from_match(match: str):
-    match_obj = re.match(r'(.*)__(.*)__(.*)__(.*)', match)
-    return match_obj.group(1), match_obj.group(2), match_obj.group(3), match_obj.group(4)
+    graph.add_nodes_from(nodes)
+    graph.add_edges_from((nodes[i], nodes[j]) for i, j in zip(rows, cols))
+    nx.draw(graph)
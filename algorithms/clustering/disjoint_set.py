@@ -0,0 +1,66 @@
+import numpy as np
+
+
+class DisjointSet(object):
+    """
+    A class used to find the connected components of a graph over integer vertex ids with union-find
+
+    Attributes
+    ----------
+    parents : ndarray
+        the parent of every vertex, the roots are their own parents
+
+    Methods
+    -------
+    find(x: int)
+        Returns the root of the component of x
+
+    union(x: int, y: int)
+        Merges the components of x and y
+
+    union_edges(rows, cols)
+        Merges the components of the endpoints of every edge
+
+    components()
+        Returns the components as lists of vertex ids
+    """
+    def __init__(self, size: int):
+        """
+        Parameters
+        ----------
+        size : int
+            the number of vertexes
+        """
+        self.parents = np.arange(size)
+
+    def find(self, x: int):
+        """Returns the root of the component of x, halving the path on the way"""
+        parents = self.parents
+        while parents[x] != x:
+            parents[x] = parents[parents[x]]
+            x = parents[x]
+        return x
+
+    def union(self, x: int, y: int):
+        """Merges the components of x and y, the smallest root becomes the root of the merged component"""
+        root_x = self.find(x)
+        root_y = self.find(y)
+        if root_x < root_y:
+            self.parents[root_y] = root_x
+        elif root_y < root_x:
+            self.parents[root_x] = root_y
+
+    def union_edges(self, rows, cols):
+        """Merges the components of the endpoints of every edge (rows[k], cols[k])"""
+        for x, y in zip(np.asarray(rows).tolist(), np.asarray(cols).tolist()):
+            self.union(x, y)
+
+    def components(self):
+        """
+        Returns the components as lists of vertex ids in ascending order. The components are ordered by their
+        smallest vertex, the way a graph traversal from every unvisited vertex in order finds them.
+        """
+        roots = np.array([self.find(x) for x in range(len(self.parents))], dtype=np.int64)
+        order = np.argsort(roots, kind='stable')
+        boundaries = np.flatnonzero(np.diff(roots[order])) + 1
+        return [component.tolist() for component in np.split(order, boundaries)] if len(order) > 0 else list()
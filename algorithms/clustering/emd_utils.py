@@ -1,10 +1,171 @@
 import math
+
+import numpy as np
+from numpy import ndarray
 from pyemd import emd
 from algorithms.clustering.column_model import Column
-from algorithms.clustering.quantile_histogram.histogram import QuantileHistogram
+from algorithms.clustering.quantile_histogram.histogram import QuantileHistogram, ground_distance_matrix
+
+EMD_BACKENDS = ('pyemd', 'cumsum')
+MASS_TOLERANCE = 1e-9
+
+
+def cumsum_emd(values: ndarray, others: ndarray):
+    """
+    Closed form of the 1-D EMD between one histogram and many histograms with the same total mass
+
+    With the ground distance |i - j| / quantiles between the buckets, the EMD is the L1 distance between the
+    cumulative distributions scaled by the bucket width, so no transportation problem has to be solved.
+
+    Parameters
+    ---------
+    values : ndarray
+        the bucket values of the first histogram
+    others : ndarray
+        a (histograms, quantiles) array with the bucket values of the other histograms
+
+    Returns
+    -------
+    ndarray
+        the EMD values between the first histogram and every other histogram
+    """
+    quantiles = len(values)
+    return np.abs(np.cumsum(others, axis=1) - np.cumsum(values))[:, :-1].sum(axis=1) / quantiles
+
+
+def batch_histogram_emd(values: ndarray, others: ndarray, backend: str = 'pyemd'):
+    """
+    Computes the EMD between one histogram and many histograms that share its bucket boundaries
+
+    The 'pyemd' backend solves a transportation problem for every pair. The 'cumsum' backend uses the closed form
+    of `cumsum_emd` for the histograms with the same total mass as the first one, where it gives the same distance,
+    and falls back to pyemd for the rest because the extra mass penalty of pyemd has no closed form.
+
+    Parameters
+    ---------
+    values : ndarray
+        the bucket values of the first histogram
+    others : ndarray
+        a (histograms, quantiles) array with the bucket values of the other histograms
+    backend : str, optional
+        the EMD engine, one of EMD_BACKENDS (default is 'pyemd')
+
+    Returns
+    -------
+    ndarray
+        the EMD values between the first histogram and every other histogram
+    """
+    if backend not in EMD_BACKENDS:
+        raise ValueError("Unknown EMD backend '{}', expected one of {}".format(backend, EMD_BACKENDS))
+    result = np.empty(len(others))
+    closed_form = np.zeros(len(others), dtype=bool)
+    if backend == 'cumsum':
+        closed_form = np.abs(others.sum(axis=1) - values.sum()) <= MASS_TOLERANCE
+        result[closed_form] = cumsum_emd(values, others[closed_form])
+    dist_matrix = ground_distance_matrix(len(values))
+    for i in np.flatnonzero(~closed_form):
+        result[i] = emd(values, np.ascontiguousarray(others[i]), dist_matrix)
+    return result
+
+
+def histogram_emd(values1: ndarray, values2: ndarray, backend: str = 'pyemd'):
+    """
+    Computes the EMD between two histograms that share the same bucket boundaries
+
+    Parameters
+    ---------
+    values1 : ndarray
+        the bucket values of the first histogram
+    values2 : ndarray
+        the bucket values of the second histogram
+    backend : str, optional
+        the EMD engine, one of EMD_BACKENDS (default is 'pyemd')
+
+    Returns
+    -------
+    float
+        the EMD value between the two histograms
+    """
+    return batch_histogram_emd(values1, values2[np.newaxis, :], backend)[0]
 
 
-def quantile_emd(column1: Column, column2: Column, quantiles: int = 256):
+def reference_emd(histogram1: QuantileHistogram, ranks2: ndarray, size2: int, backend: str = 'pyemd'):
+    """
+    Computes the EMD between a quantile histogram and the histogram of another column's ranks, which is created by
+    doing a linear scan over the first's bucket boundaries
+
+    Parameters
+    ---------
+    histogram1 : QuantileHistogram
+        The quantile histogram of the first column
+    ranks2 : ndarray
+        The ranks of the second column
+    size2 : int
+        The size of the second column, which normalizes its histogram
+    backend : str, optional
+        the EMD engine, one of EMD_BACKENDS (default is 'pyemd')
+
+    Returns
+    -------
+    float
+        the EMD value between the two columns
+    """
+    values2 = histogram1.bucket_counts(ranks2) / size2
+    if np.sum(values2) == 0:
+        return math.inf
+    return histogram_emd(histogram1.get_values, values2, backend)
+
+
+def reference_emd_many(histogram1: QuantileHistogram, ranks: list, sizes, backend: str = 'pyemd'):
+    """
+    Computes the EMD between a quantile histogram and the histograms of many columns' ranks, which are created by
+    doing a linear scan over the first's bucket boundaries, with one call of batch_histogram_emd
+
+    Parameters
+    ---------
+    histogram1 : QuantileHistogram
+        The quantile histogram of the first column
+    ranks : list(ndarray)
+        The ranks of the other columns
+    sizes : ndarray
+        The sizes of the other columns, which normalize their histograms
+    backend : str, optional
+        the EMD engine, one of EMD_BACKENDS (default is 'pyemd')
+
+    Returns
+    -------
+    ndarray
+        the EMD values between the first column and every other column, inf for the columns without any rank in
+        the histogram
+    """
+    result = np.full(len(ranks), math.inf)
+    if len(ranks) == 0:
+        return result
+    others = np.array([histogram1.bucket_counts(column_ranks) / size for column_ranks, size in zip(ranks, sizes)])
+    non_empty = others.sum(axis=1) != 0
+    if non_empty.any():
+        result[non_empty] = batch_histogram_emd(histogram1.get_values, others[non_empty], backend)
+    return result
+
+
+def sorted_isin(ranks: ndarray, other: ndarray):
+    """
+    Returns which of the sorted ranks are in the sorted other ranks with one vectorized binary search
+
+    Parameters
+    ---------
+    ranks : ndarray
+        the sorted ranks to look up
+    other : ndarray
+        the sorted ranks to look in
+    """
+    if len(other) == 0:
+        return np.zeros(len(ranks), dtype=bool)
+    idx = np.minimum(np.searchsorted(other, ranks), len(other) - 1)
+    return other[idx] == ranks
+
+
+def quantile_emd(column1: Column, column2: Column, quantiles: int = 256, backend: str = 'pyemd'):
     """
     Computes the Earth Mover's Distance (EMD) over two column quantile histograms
 
@@ -19,21 +180,18 @@ def quantile_emd(column1: Column, column2: Column, quantiles: int = 256):
         The second column that we create its quantile histogram by doing a linear scan over the first's
     quantiles: int, optional
         The number of quantiles that the histograms are split on (default is 256)
+    backend : str, optional
+        the EMD engine, one of EMD_BACKENDS (default is 'pyemd')
 
     Returns
     -------
     float
         the EMD value between column1 and column2
     """
-    histogram1 = column1.get_histogram()
-    histogram2 = QuantileHistogram(column2.get_long_name(), column2.ranks, column2.size, quantiles,
-                                   reference_hist=histogram1)
-    if histogram2.is_empty:
-        return math.inf
-    return emd(histogram1.get_values, histogram2.get_values, histogram1.dist_matrix)
+    return reference_emd(column1.get_histogram(), column2.ranks, column2.size, backend)
 
 
-def intersection_emd(column1: Column, column2: Column, quantiles: int = 256):
+def intersection_emd(column1: Column, column2: Column, quantiles: int = 256, backend: str = 'pyemd'):
     """
     Computes the intersection Earth Mover's Distance (EMD) over two column quantile histograms as described in
     "Automatic Discovery of Attributes in Relational Databases"
@@ -51,27 +209,98 @@ def intersection_emd(column1: Column, column2: Column, quantiles: int = 256):
         The second column
     quantiles: int, optional
         The number of quantiles that the histograms are split on (default is 256)
+    backend : str, optional
+        the EMD engine, one of EMD_BACKENDS (default is 'pyemd')
 
     Returns
     -------
     float
         the intersection EMD value between column1 and column2
     """
-    common_elements = set(list(column1.get_original_data())).intersection(set(list(column2.get_original_data())))
+    return ranks_intersection_emd(column1.get_histogram(), column1.ranks, column2.get_histogram(), column2.ranks,
+                                  backend)
+
+
+def ranks_intersection_emd(histogram1: QuantileHistogram, ranks1: ndarray, histogram2: QuantileHistogram,
+                           ranks2: ndarray, backend: str = 'pyemd'):
+    """
+    Computes the intersection EMD of two columns from their quantile histograms and sorted ranks, without creating
+    a column for the intersection. Since the global ranks map every distinct value to a distinct rank, the
+    intersection of the ranks is the intersection of the values.
+
+    Parameters
+    ---------
+    histogram1 : QuantileHistogram
+        The quantile histogram of the first column
+    ranks1 : ndarray
+        The sorted ranks of the first column
+    histogram2 : QuantileHistogram
+        The quantile histogram of the second column
+    ranks2 : ndarray
+        The sorted ranks of the second column
+    backend : str, optional
+        the EMD engine, one of EMD_BACKENDS (default is 'pyemd')
+
+    Returns
+    -------
+    float
+        the intersection EMD value between the two columns
+    """
+    in1 = sorted_isin(ranks1, ranks2)
 
     # If the two columns do not share any common elements return inf
-    if len(common_elements) == 0:
+    if not in1.any():
         return math.inf
 
-    intersection = [x for x in list(column1.get_original_data()) + list(column2.get_original_data())
-                    if x in common_elements]  # The intersection of the two columns
+    # The intersection of the two columns
+    intersection = np.concatenate((ranks1[in1], ranks2[sorted_isin(ranks2, ranks1)]))
 
-    intersection_column = Column("Intersection of " + column1.get_long_name() + " " + column2.get_long_name(),
-                                 intersection, "", "", quantiles)
+    e1 = reference_emd(histogram1, intersection, len(intersection), backend)
+    e2 = reference_emd(histogram2, intersection, len(intersection), backend)
 
-    e1 = quantile_emd(column1, intersection_column, quantiles)
-    e2 = quantile_emd(column2, intersection_column, quantiles)
+    return (e1 + e2) / 2
 
-    del common_elements, intersection, intersection_column
 
-    return (e1 + e2) / 2
+def ranks_intersection_emd_many(histogram1: QuantileHistogram, ranks1: ndarray, histograms2: list, ranks2: list,
+                                backend: str = 'pyemd'):
+    """
+    Computes the intersection EMD between a column and many columns from their quantile histograms and sorted ranks,
+    see ranks_intersection_emd. The EMD of the intersections with the first column's histogram are computed with one
+    call of batch_histogram_emd.
+
+    Parameters
+    ---------
+    histogram1 : QuantileHistogram
+        The quantile histogram of the first column
+    ranks1 : ndarray
+        The sorted ranks of the first column
+    histograms2 : list(QuantileHistogram)
+        The quantile histograms of the other columns
+    ranks2 : list(ndarray)
+        The sorted ranks of the other columns
+    backend : str, optional
+        the EMD engine, one of EMD_BACKENDS (default is 'pyemd')
+
+    Returns
+    -------
+    ndarray
+        the intersection EMD values between the first column and every other column
+    """
+    result = np.full(len(ranks2), math.inf)
+    common = list()
+    intersections = list()
+    for k, other in enumerate(ranks2):
+        in1 = sorted_isin(ranks1, other)
+        # If the two columns do not share any common elements the EMD is inf
+        if in1.any():
+            common.append(k)
+            intersections.append(np.concatenate((ranks1[in1], other[sorted_isin(other, ranks1)])))
+    if len(common) == 0:
+        return result
+
+    sizes = np.array([len(intersection) for intersection in intersections])
+    e1 = reference_emd_many(histogram1, intersections, sizes, backend)
+    e2 = np.array([reference_emd(histograms2[k], intersection, len(intersection), backend)
+                   for k, intersection in zip(common, intersections)])
+    result[common] = (e1 + e2) / 2
+    return result
@@ -0,0 +1,738 @@
+import hashlib
+import heapq
+import os
+import tempfile
+from itertools import islice
+
+import numpy as np
+import pandas as pd
+from numpy import ndarray
+
+GLOBAL_RANKS_DIR = 'cache/global_ranks'
+
+# The leading number of a line the way "sort -n" reads it in the C locale: blanks, an optional minus sign, digits and
+# one decimal point. Lines without it count as 0.
+SORT_N_NUMBER = r'^[ \t]*(-?(?:\d+\.?\d*|\.\d+))'
+
+# The arrays of a rank index, saved as <name>.npy files
+RANK_INDEX_ARRAYS = ('sort_keys', 'ranks', 'is_string', 'numbers', 'text_offsets', 'texts', 'sorted_numbers',
+                     'number_positions', 'string_hashes', 'string_positions')
+
+# The number of values written or hashed at once when the rank index is built or fingerprinted
+CHUNK_SIZE = 1 << 20
+
+# The rank indexes loaded by the process, keyed by their folder
+loaded_rank_indexes = dict()
+
+
+class RankIndex(object):
+    """
+    A class used to represent the global ranks of all the distinct values of the database as arrays, so that whole
+    columns can be ranked at once and the index can be memory-mapped and shared instead of unpickled
+
+    The values are kept in the order of their ranks, which is the order of their lines in the output of "sort -n"
+    (see sort_n_sorted). The lines are stored as UTF-8 bytes one after the other, so every value takes its own length
+    instead of the length of the longest one. The numbers are looked up in a sorted array of their float values, the
+    same way a Python dict treats 1 and 1.0 as the same key, and the strings by their sorted hashes.
+
+    Attributes
+    ----------
+    sort_keys : ndarray
+        the leading number of the line of every value, see sort_n_sorted
+    ranks : ndarray
+        the global rank of every value, in ascending order
+    is_string : ndarray
+        whether every value is a string
+    numbers : ndarray
+        the numeric value of every value, 0 for the strings
+    text_offsets : ndarray
+        the line of the value i is the UTF-8 bytes texts[text_offsets[i]:text_offsets[i + 1]]
+    texts : ndarray
+        the UTF-8 bytes of all the lines
+    sorted_numbers : ndarray
+        the distinct numeric values sorted
+    number_positions : ndarray
+        the position of every sorted number, the highest ranked one if two numbers are equal as floats
+    string_hashes : ndarray
+        the sorted hashes of the strings
+    string_positions : ndarray
+        the position of the string of every hash
+
+    Methods
+    -------
+    from_lines(sort_keys, ranks, is_string, numbers, texts)
+        Creates a rank index from the values in the order of their ranks
+
+    load(path: str, mmap_mode: str)
+        Loads a rank index saved with save, optionally memory-mapping its arrays
+
+    save(path: str)
+        Saves the rank index as .npy array files
+
+    fingerprint()
+        Returns a hash of the values and their ranks
+
+    text(i: int)
+        Returns the line of the value i
+
+    lookup(values)
+        Returns the global ranks of the values
+
+    contains(values)
+        Returns which of the values are in the index
+    """
+    def __init__(self, sort_keys: ndarray, ranks: ndarray, is_string: ndarray, numbers: ndarray,
+                 text_offsets: ndarray, texts: ndarray, sorted_numbers: ndarray, number_positions: ndarray,
+                 string_hashes: ndarray, string_positions: ndarray):
+        self.sort_keys = sort_keys
+        self.ranks = ranks
+        self.is_string = is_string
+        self.numbers = numbers
+        self.text_offsets = text_offsets
+        self.texts = texts
+        self.sorted_numbers = sorted_numbers
+        self.number_positions = number_positions
+        self.string_hashes = string_hashes
+        self.string_positions = string_positions
+
+    def __len__(self):
+        return len(self.ranks)
+
+    @classmethod
+    def from_lines(cls, sort_keys: ndarray, ranks: ndarray, is_string: ndarray, numbers: ndarray, texts: list):
+        """
+        Parameters
+        ----------
+        sort_keys : ndarray
+            the leading number of the line of every value, see sort_n_sorted
+        ranks : ndarray
+            the global rank of every value in ascending order, fractional ranks are kept as floats
+        is_string : ndarray
+            whether every value is a string
+        numbers : ndarray
+            the numeric value of every value, 0 for the strings
+        texts : list(str)
+            the line of every value
+        """
+        ranks = np.asarray(ranks)
+        ranks = ranks.astype(np.float64 if ranks.dtype.kind == 'f' else np.int64)
+        is_string = np.asarray(is_string, dtype=bool)
+        numbers = np.asarray(numbers, dtype=float)
+        text_offsets, text_bytes = encode_texts(texts)
+        sorted_numbers, number_positions = number_lookup(numbers, is_string, ranks)
+        string_positions = np.flatnonzero(is_string)
+        string_hashes, string_positions = string_lookup(hash_texts([texts[i] for i in string_positions]),
+                                                        string_positions)
+        return cls(np.asarray(sort_keys, dtype=float), ranks, is_string, numbers, text_offsets, text_bytes,
+                   sorted_numbers, number_positions, string_hashes, string_positions)
+
+    @classmethod
+    def load(cls, path: str = GLOBAL_RANKS_DIR, mmap_mode: str = 'r'):
+        """
+        Parameters
+        ----------
+        path : str, optional
+            the folder the rank index was saved in (default is cache/global_ranks)
+        mmap_mode : str, optional
+            the numpy.load memory-map mode of the arrays, None reads them in memory (default is 'r')
+        """
+        return cls(*[np.load(os.path.join(path, name + '.npy'), mmap_mode=mmap_mode) for name in RANK_INDEX_ARRAYS])
+
+    def save(self, path: str = GLOBAL_RANKS_DIR, version: str = None):
+        """
+        Parameters
+        ----------
+        path : str, optional
+            the folder to save the rank index in (default is cache/global_ranks)
+        version : str, optional
+            the version of the ranks, see rank_index_version. An index that keeps the ranks of the saved one passes
+            its version (default is the fingerprint of the index, a new version)
+        """
+        if not os.path.exists(path):
+            os.makedirs(path)
+        # write new files instead of overwriting the ones that other indexes might have memory-mapped
+        for name in RANK_INDEX_ARRAYS:
+            np.save(tmp_array_file(path, name), getattr(self, name))
+        publish_rank_index(path, self.fingerprint() if version is None else version)
+
+    def fingerprint(self):
+        """Returns a hash of the values and their ranks, reading the arrays chunk by chunk"""
+        digest = hashlib.sha256()
+        for name in RANK_INDEX_ARRAYS:
+            array = getattr(self, name)
+            digest.update(str((name, array.dtype.str, array.shape)).encode('utf-8'))
+            for start in range(0, len(array), CHUNK_SIZE):
+                digest.update(np.ascontiguousarray(array[start:start + CHUNK_SIZE]).tobytes())
+        return digest.hexdigest()
+
+    def text(self, i: int):
+        """Returns the line of the value i"""
+        return bytes(self.texts[self.text_offsets[i]:self.text_offsets[i + 1]]).decode('utf-8')
+
+    def lookup(self, values):
+        """
+        Returns the global ranks of the values
+
+        Parameters
+        ----------
+        values : list or ndarray or pandas.Series
+            the values to rank, every one of them must be in the index
+
+        Returns
+        -------
+        ndarray
+            the global ranks in the order of the values
+        """
+        values, positions, found = self.__locate(values)
+        if not found.all():
+            raise KeyError(values[np.argmin(found)])
+        if len(positions) == 0:
+            return np.empty(0, dtype=self.ranks.dtype)
+        return np.asarray(self.ranks[positions])
+
+    def contains(self, values):
+        """Returns which of the values are in the index"""
+        return self.__locate(values)[2]
+
+    def __locate(self, values):
+        values = np.asarray(values, dtype=object) if isinstance(values, list) else np.asarray(values)
+        if values.dtype.kind in 'biuf':
+            return (values, *self.__search_numbers(values.astype(float)))
+        if values.dtype.kind == 'U':
+            return (values, *self.__search_strings(values.astype(object)))
+        is_string = np.array([isinstance(value, str) for value in values], dtype=bool)
+        positions = np.empty(len(values), dtype=np.int64)
+        found = np.empty(len(values), dtype=bool)
+        positions[is_string], found[is_string] = self.__search_strings(values[is_string])
+        positions[~is_string], found[~is_string] = self.__search_numbers(values[~is_string].astype(float))
+        return values, positions, found
+
+    def __search_numbers(self, values: ndarray):
+        if len(values) == 0 or len(self.sorted_numbers) == 0:
+            return np.zeros(len(values), dtype=np.int64), np.zeros(len(values), dtype=bool)
+        idx = np.minimum(np.searchsorted(self.sorted_numbers, values), len(self.sorted_numbers) - 1)
+        return np.asarray(self.number_positions[idx]), np.asarray(self.sorted_numbers[idx]) == values
+
+    def __search_strings(self, values: ndarray):
+        positions = np.zeros(len(values), dtype=np.int64)
+        found = np.zeros(len(values), dtype=bool)
+        if len(values) == 0 or len(self.string_hashes) == 0:
+            return positions, found
+        hashes = hash_texts(values)
+        idx = np.minimum(np.searchsorted(self.string_hashes, hashes), len(self.string_hashes) - 1)
+        candidates = np.flatnonzero(np.asarray(self.string_hashes[idx]) == hashes)
+        positions[candidates] = self.string_positions[idx[candidates]]
+        found[candidates] = texts_equal(self.text_offsets, self.texts, positions[candidates],
+                                        [values[k] for k in candidates])
+        # the strings that share a hash with another one are compared one by one
+        for k in candidates[~found[candidates]]:
+            i = idx[k] + 1
+            while i < len(self.string_hashes) and self.string_hashes[i] == hashes[k] and not found[k]:
+                if self.text(self.string_positions[i]) == values[k]:
+                    positions[k], found[k] = self.string_positions[i], True
+                i += 1
+        return positions, found
+
+
+def encode_texts(texts: list):
+    """
+    Helper function that stores the texts as UTF-8 bytes one after the other
+
+    Returns
+    -------
+    tuple
+        the offsets of the texts, the text i is the bytes [offsets[i], offsets[i + 1]), and the bytes
+    """
+    encoded = [text.encode('utf-8') for text in texts]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(text) for text in encoded], out=offsets[1:])
+    return offsets, np.frombuffer(b''.join(encoded), dtype=np.uint8).copy()
+
+
+def hash_texts(texts):
+    """Helper function that hashes the texts (str or UTF-8 bytes) to 64 bits"""
+    return pd.util.hash_array(np.array(texts, dtype=object)) if len(texts) > 0 else np.empty(0, dtype=np.uint64)
+
+
+def gather_texts(offsets: ndarray, texts: ndarray, positions: ndarray):
+    """
+    Helper function that copies the UTF-8 bytes of the texts at the positions one after the other
+
+    Returns
+    -------
+    tuple
+        the lengths of the texts and their bytes
+    """
+    starts = np.asarray(offsets[positions])
+    lengths = np.asarray(offsets[positions + 1]) - starts
+    shifts = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+    return lengths, np.asarray(texts[np.arange(np.sum(lengths), dtype=np.int64) + shifts])
+
+
+def texts_equal(offsets: ndarray, texts: ndarray, positions: ndarray, values: list):
+    """Helper function that compares the stored texts at the positions with the values, all at once"""
+    value_offsets, value_bytes = encode_texts(values)
+    equal = np.asarray(offsets[positions + 1]) - np.asarray(offsets[positions]) == np.diff(value_offsets)
+    same_length = np.flatnonzero(equal)
+    lengths, stored_bytes = gather_texts(offsets, texts, positions[same_length])
+    _, value_bytes = gather_texts(value_offsets, value_bytes, same_length)
+    mismatches = np.concatenate(([0], np.cumsum(stored_bytes != value_bytes)))
+    ends = np.cumsum(lengths)
+    equal[same_length] = mismatches[ends] == mismatches[ends - lengths]
+    return equal
+
+
+def number_lookup(numbers: ndarray, is_string: ndarray, ranks: ndarray):
+    """
+    Helper function that sorts the numbers for the lookups, keeping the position of the highest ranked one if two
+    numbers are equal as floats
+
+    Returns
+    -------
+    tuple
+        the distinct sorted numbers and their positions
+    """
+    positions = np.flatnonzero(~np.asarray(is_string))
+    order = np.lexsort((np.asarray(ranks[positions]), np.asarray(numbers[positions])))
+    positions = positions[order]
+    sorted_numbers = np.asarray(numbers[positions])
+    last = np.ones(len(sorted_numbers), dtype=bool)
+    last[:-1] = sorted_numbers[1:] != sorted_numbers[:-1]
+    return sorted_numbers[last], positions[last]
+
+
+def string_lookup(hashes: ndarray, positions: ndarray):
+    """Helper function that sorts the hashes of the strings at the positions for the lookups"""
+    order = np.argsort(hashes, kind='stable')
+    return hashes[order], np.asarray(positions, dtype=np.int64)[order]
+
+
+def publish_rank_index(path: str, version: str):
+    """
+    Replaces the rank index saved in the folder with the one written to its <name>.tmp.npy files, and then its version
+
+    Parameters
+    ----------
+    path : str
+        the folder of the rank index
+    version : str
+        the version of the ranks of the new rank index, see rank_index_version
+    """
+    for name in RANK_INDEX_ARRAYS:
+        os.replace(tmp_array_file(path, name), os.path.join(path, name + '.npy'))
+    with open(os.path.join(path, 'version.tmp'), 'w') as fp:
+        fp.write(version)
+    os.replace(os.path.join(path, 'version.tmp'), os.path.join(path, 'version'))
+
+
+def get_rank_index(path: str = GLOBAL_RANKS_DIR):
+    """
+    Returns the rank index saved in the folder, which is loaded memory-mapped once per process and shared by all
+    the columns. It is loaded again only if the index is saved anew.
+
+    Parameters
+    ----------
+    path : str, optional
+        the folder the rank index was saved in (default is cache/global_ranks)
+    """
+    version = os.path.getmtime(os.path.join(path, 'ranks.npy'))
+    if path not in loaded_rank_indexes or loaded_rank_indexes[path][0] != version:
+        loaded_rank_indexes[path] = (version, RankIndex.load(path))
+    return loaded_rank_indexes[path][1]
+
+
+def rank_index_version(path: str = GLOBAL_RANKS_DIR):
+    """
+    Returns the version of the ranks of the rank index saved in the folder, or the modification time of an index
+    saved without it. The version is the fingerprint of the index when it was computed anew. Inserting values with
+    update_global_ranks keeps it as long as the ranks of the values already in the index do not change, so the
+    columns ranked with it stay valid (e.g. in the histogram cache).
+
+    Parameters
+    ----------
+    path : str, optional
+        the folder the rank index was saved in (default is cache/global_ranks)
+    """
+    if os.path.exists(os.path.join(path, 'version')):
+        with open(os.path.join(path, 'version'), 'r') as fp:
+            return fp.read()
+    return str(os.path.getmtime(os.path.join(path, 'ranks.npy')))
+
+
+def update_global_ranks(values, path: str = GLOBAL_RANKS_DIR):
+    """
+    Makes sure that the saved rank index contains the values, adding the missing ones with insert_global_ranks. The
+    version of the ranks (see rank_index_version) is kept unless the values had to be ranked anew.
+
+    Parameters
+    ----------
+    values : iterable
+        the distinct values of new data
+    path : str, optional
+        the folder of the rank index (default is cache/global_ranks)
+    """
+    values = list(values)
+    if not os.path.exists(os.path.join(path, 'ranks.npy')):
+        compute_global_ranks(values).save(path)
+        return
+    index = get_rank_index(path)
+    updated = insert_global_ranks(index, values)
+    if updated is not index:
+        print("Adding ", len(updated) - len(index), " new values to the global ranks")
+        # the columns ranked with the old index stay valid only if their ranks are kept, else the version is new
+        updated.save(path, rank_index_version(path) if keeps_ranks(updated) else None)
+
+
+def sort_n_sorted(values):
+    """
+    A UNIX-like "sort -n" over the string representations of the values in the C locale. The lines are sorted on
+    their leading number, which is 0 for the lines that do not start with one, and the ties are broken by comparing
+    the whole lines. The leading numbers are compared as floats.
+
+    Parameters
+    ----------
+    values : iterable
+        the distinct values
+
+    Returns
+    -------
+    tuple
+        the sorted arrays (keys, texts, is_string, numbers) with the leading numbers, the lines, whether the values
+        are strings and the numeric values (0 for strings)
+    """
+    values = list(values)
+    texts = np.array([str(value) for value in values], dtype=object)
+    is_string = np.array([isinstance(value, str) for value in values], dtype=bool)
+    numbers = np.array([0 if isinstance(value, str) else value for value in values], dtype=float)
+    prefix = pd.Series(texts, dtype=object).str.extract(SORT_N_NUMBER, expand=False)
+    keys = pd.to_numeric(prefix, errors='coerce').fillna(0).to_numpy(dtype=float)
+    order = np.lexsort((is_string, texts, keys))
+    return keys[order], texts[order], is_string[order], numbers[order]
+
+
+def compute_global_ranks(values):
+    """
+    Computes the global ranks of the distinct values in memory. The rank of a value is its line number in the output
+    of "sort -n" (see sort_n_sorted).
+
+    Parameters
+    ----------
+    values : iterable
+        the distinct values of the database
+
+    Returns
+    -------
+    RankIndex
+        the rank index of the values
+    """
+    keys, texts, is_string, numbers = sort_n_sorted(values)
+    return RankIndex.from_lines(keys, np.arange(1, len(texts) + 1), is_string, numbers, list(texts))
+
+
+def build_global_ranks(batches, path: str = GLOBAL_RANKS_DIR, run_size: int = 1000000, tmp_dir: str = None):
+    """
+    Computes the global ranks of the values of a corpus that might not fit in memory with an external merge sort and
+    saves them in the folder. The distinct values are collected in runs of at most run_size values, every full run is
+    sorted as in sort_n_sorted and spilled to disk, and the runs are merged at the end straight into the files of the
+    rank index (see write_rank_index). If the values fit in one run they are ranked in memory.
+
+    Parameters
+    ----------
+    batches : iterable
+        the values of the corpus in batches, e.g. one batch per column
+    path : str, optional
+        the folder to save the rank index in (default is cache/global_ranks)
+    run_size : int, optional
+        the number of distinct values sorted in memory at once (default is 1000000)
+    tmp_dir : str, optional
+        the folder of the spilled runs (default is the system's temporary folder)
+
+    Returns
+    -------
+    RankIndex
+        the saved rank index, memory-mapped
+    """
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as tmp:
+        runs = list()
+        run = set()
+        for batch in batches:
+            run.update(batch)
+            if len(run) >= run_size:
+                runs.append(spill_run(run, os.path.join(tmp, str(len(runs)))))
+                run = set()
+        if len(runs) == 0:
+            compute_global_ranks(run).save(path)
+            return RankIndex.load(path)
+        if len(run) > 0:
+            runs.append(spill_run(run, os.path.join(tmp, str(len(runs)))))
+        run = None  # the last run is spilled, so it is not kept in memory during the merge
+
+        keep = first_numbers(runs)
+        lines = heapq.merge(*[read_run(run_path, run_keep) for run_path, run_keep in zip(runs, keep)])
+        write_rank_index(unique_lines(lines), path, tmp)
+    return RankIndex.load(path)
+
+
+def first_numbers(runs: list):
+    """
+    Helper function that finds the numbers of the spilled runs to merge. A number equal as a float to one of an
+    earlier run, e.g. 1.0 after 1, is dropped the same way a set of all the values keeps the first of them, even when
+    their lines are not next to each other in the merged runs (1 and 1.0 are separated by 1-x, 1e+20 and 10**20 do
+    not even share their leading number).
+
+    Returns
+    -------
+    list(ndarray)
+        whether every line of every run is merged
+    """
+    keep = list()
+    numbers, run_ids, positions = list(), list(), list()
+    for run_id, run_path in enumerate(runs):
+        is_string = np.load(os.path.join(run_path, 'is_string.npy'))
+        keep.append(np.ones(len(is_string), dtype=bool))
+        positions.append(np.flatnonzero(~is_string))
+        numbers.append(np.load(os.path.join(run_path, 'numbers.npy'))[positions[-1]])
+        run_ids.append(np.full(len(positions[-1]), run_id))
+    numbers, run_ids, positions = np.concatenate(numbers), np.concatenate(run_ids), np.concatenate(positions)
+    order = np.lexsort((run_ids, numbers))
+    numbers, run_ids, positions = numbers[order], run_ids[order], positions[order]
+    later = np.zeros(len(numbers), dtype=bool)
+    later[1:] = numbers[1:] == numbers[:-1]
+    for run_id, run_keep in enumerate(keep):
+        run_keep[positions[later & (run_ids == run_id)]] = False
+    return keep
+
+
+def unique_lines(lines):
+    """Skips the lines of a string spilled in more than one run, which are next to each other in the merged runs"""
+    previous = None
+    for line in lines:
+        if previous is None or line[:3] != previous[:3]:
+            yield line
+        previous = line
+
+
+def write_rank_index(lines, path: str, tmp: str):
+    """
+    Saves the rank index of the sorted lines of sort_n_sorted, ranked by their position. The lines are written to
+    raw files CHUNK_SIZE at a time and then copied to the .npy files, so only the lookup arrays of the numbers and of
+    the string hashes are sorted in memory.
+
+    Parameters
+    ----------
+    lines : iterable
+        the sorted (key, text, is_string, number) lines of the distinct values
+    path : str
+        the folder to save the rank index in
+    tmp : str
+        the folder of the raw files
+    """
+    raw = {name: open(os.path.join(tmp, name + '.bin'), 'wb')
+           for name in ('sort_keys', 'is_string', 'numbers', 'text_lengths', 'texts', 'string_hashes',
+                        'string_positions')}
+    count = 0
+    lines = iter(lines)
+    chunk = list(islice(lines, CHUNK_SIZE))
+    while len(chunk) > 0:
+        keys, texts, is_string, numbers = zip(*chunk)
+        encoded = [text.encode('utf-8') for text in texts]
+        strings = np.flatnonzero(is_string)
+        raw['sort_keys'].write(np.array(keys, dtype=float).tobytes())
+        raw['is_string'].write(np.array(is_string, dtype=bool).tobytes())
+        raw['numbers'].write(np.array(numbers, dtype=float).tobytes())
+        raw['text_lengths'].write(np.array([len(text) for text in encoded], dtype=np.int64).tobytes())
+        raw['texts'].write(b''.join(encoded))
+        raw['string_hashes'].write(hash_texts([encoded[i] for i in strings]).tobytes())
+        raw['string_positions'].write((strings + count).astype(np.int64).tobytes())
+        count += len(chunk)
+        chunk = list(islice(lines, CHUNK_SIZE))
+    for file in raw.values():
+        file.close()
+
+    if not os.path.exists(path):
+        os.makedirs(path)
+    files = {name: tmp_array_file(path, name) for name in RANK_INDEX_ARRAYS}
+    for name, dtype in (('sort_keys', float), ('is_string', bool), ('numbers', float), ('texts', np.uint8)):
+        np.save(files[name], read_raw_array(tmp, name, dtype))
+
+    ranks = np.lib.format.open_memmap(files['ranks'], mode='w+', dtype=np.int64, shape=(count,))
+    text_offsets = np.lib.format.open_memmap(files['text_offsets'], mode='w+', dtype=np.int64, shape=(count + 1,))
+    text_lengths = read_raw_array(tmp, 'text_lengths', np.int64)
+    text_offsets[0] = 0
+    for start in range(0, count, CHUNK_SIZE):
+        end = min(start + CHUNK_SIZE, count)
+        ranks[start:end] = np.arange(start + 1, end + 1)
+        text_offsets[start + 1:end + 1] = text_offsets[start] + np.cumsum(text_lengths[start:end])
+    ranks.flush()
+    text_offsets.flush()
+    del ranks, text_offsets, text_lengths
+
+    sorted_numbers, number_positions = number_lookup(np.load(files['numbers'], mmap_mode='r'),
+                                                     np.load(files['is_string'], mmap_mode='r'),
+                                                     np.load(files['ranks'], mmap_mode='r'))
+    np.save(files['sorted_numbers'], sorted_numbers)
+    np.save(files['number_positions'], number_positions)
+    del sorted_numbers, number_positions
+    string_hashes, string_positions = string_lookup(read_raw_array(tmp, 'string_hashes', np.uint64),
+                                                    read_raw_array(tmp, 'string_positions', np.int64))
+    np.save(files['string_hashes'], string_hashes)
+    np.save(files['string_positions'], string_positions)
+    del string_hashes, string_positions
+
+    index = RankIndex(*[np.load(files[name], mmap_mode='r') for name in RANK_INDEX_ARRAYS])
+    publish_rank_index(path, index.fingerprint())
+
+
+def read_raw_array(tmp: str, name: str, dtype):
+    """Helper function that memory-maps the raw file <name>.bin of write_rank_index"""
+    file = os.path.join(tmp, name + '.bin')
+    if os.path.getsize(file) == 0:  # an empty file cannot be memory-mapped
+        return np.empty(0, dtype=dtype)
+    return np.memmap(file, dtype=dtype, mode='r')
+
+
+def tmp_array_file(path: str, name: str):
+    """Helper function that returns the file an array of a rank index is written to before publish_rank_index"""
+    return os.path.join(path, name + '.tmp.npy')
+
+
+def spill_run(run: set, path: str):
+    """Sorts a run of distinct values and saves it as .npy array files in the folder"""
+    os.makedirs(path)
+    keys, texts, is_string, numbers = sort_n_sorted(run)
+    text_offsets, texts = encode_texts(texts)
+    for name, array in zip(('keys', 'text_offsets', 'texts', 'is_string', 'numbers'),
+                           (keys, text_offsets, texts, is_string, numbers)):
+        np.save(os.path.join(path, name + '.npy'), array)
+    return path
+
+
+def read_run(path: str, keep: ndarray = None):
+    """Iterates over the lines of a spilled run in its sorted order, only the kept ones if keep is given"""
+    keys, text_offsets, texts, is_string, numbers = [np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+                                                     for name in ('keys', 'text_offsets', 'texts', 'is_string',
+                                                                  'numbers')]
+    for i in range(len(keys)) if keep is None else np.flatnonzero(keep):
+        text = bytes(texts[text_offsets[i]:text_offsets[i + 1]]).decode('utf-8')
+        yield float(keys[i]), text, bool(is_string[i]), float(numbers[i])
+
+
+def insert_global_ranks(index: RankIndex, values):
+    """
+    Adds new values to the global ranks without changing the ranks of the values already in the index. Every new
+    value gets a fractional rank between the ranks of the indexed values it is sorted between (see sort_n_sorted), so
+    the order of all the values is the same as if the ranks were computed anew but the columns ranked with the old
+    index keep their ranks, histograms and EMDs. Only the new values are sorted, the indexed lines are merged with them
+    as they are stored. If there is no float left between two ranks all the values get the integer ranks of
+    compute_global_ranks instead, which changes the ranks of the indexed values (see keeps_ranks).
+
+    Parameters
+    ----------
+    index : RankIndex
+        the current rank index
+    values : iterable
+        the distinct values to add, the ones already in the index are ignored
+
+    Returns
+    -------
+    RankIndex
+        the rank index with the new values
+    """
+    values = list(values)
+    new_values = [value for value, found in zip(values, index.contains(values)) if not found]
+    if len(new_values) == 0:
+        return index
+    keys, texts, is_string, numbers = sort_n_sorted(new_values)
+    distinct = np.ones(len(texts), dtype=bool)
+    distinct[1:] = (texts[1:] != texts[:-1]) | (is_string[1:] != is_string[:-1])
+    keys, texts, is_string, numbers = keys[distinct], texts[distinct], is_string[distinct], numbers[distinct]
+
+    # the new values between two indexed values are spread evenly between their ranks
+    points = insertion_points(index, keys, texts, is_string)
+    old_ranks = np.asarray(index.ranks, dtype=float)
+    bounds = np.concatenate(([0.0], old_ranks, [np.nan]))
+    low = bounds[points]
+    high = np.where(points < len(old_ranks), bounds[points + 1], low + 1)
+    _, starts, counts = np.unique(points, return_index=True, return_counts=True)
+    order = np.arange(len(points)) - np.repeat(starts, counts) + 1
+    new_ranks = low + (high - low) * order / np.repeat(counts + 1, counts)
+
+    text_offsets, text_bytes = encode_texts(list(texts))
+    text_lengths = np.diff(text_offsets)
+    merged_lengths = np.insert(np.diff(np.asarray(index.text_offsets)), points, text_lengths)
+    merged_offsets = np.zeros(len(merged_lengths) + 1, dtype=np.int64)
+    np.cumsum(merged_lengths, out=merged_offsets[1:])
+    merged_texts = np.insert(np.asarray(index.texts), np.repeat(np.asarray(index.text_offsets)[points], text_lengths),
+                             text_bytes)
+    merged_ranks = np.insert(old_ranks, points, new_ranks)
+
+    # the new value k is inserted k positions further down than its insertion point
+    new_positions = points + np.arange(len(points))
+
+    # a gap that is split over and over runs out of float precision (about 50 inserts at the same place), and then
+    # every value is ranked anew by its line number like compute_global_ranks does
+    if not np.all(np.diff(merged_ranks) > 0):
+        print("Ranking the ", len(merged_ranks), " global ranks anew")
+        merged_ranks = np.arange(1, len(merged_ranks) + 1, dtype=np.int64)
+        new_ranks = merged_ranks[new_positions]
+
+    new_numbers = np.flatnonzero(~is_string)
+    sorted_numbers, number_positions = number_lookup(numbers[new_numbers], is_string[new_numbers],
+                                                     new_ranks[new_numbers])
+    number_positions = new_positions[new_numbers][number_positions]
+    merged_numbers = np.asarray(index.sorted_numbers)
+    merged_number_positions = merged_positions(index.number_positions, points)
+    idx = np.searchsorted(merged_numbers, sorted_numbers)
+    equal = idx < len(merged_numbers)
+    equal[equal] = merged_numbers[idx[equal]] == sorted_numbers[equal]
+    # a new number equal to an indexed one as a float replaces it in the lookups if it is ranked higher
+    replace = equal.copy()
+    replace[equal] = merged_ranks[number_positions[equal]] > merged_ranks[merged_number_positions[idx[equal]]]
+    merged_number_positions[idx[replace]] = number_positions[replace]
+    merged_numbers = np.insert(merged_numbers, idx[~equal], sorted_numbers[~equal])
+    merged_number_positions = np.insert(merged_number_positions, idx[~equal], number_positions[~equal])
+
+    new_strings = np.flatnonzero(is_string)
+    string_hashes, string_positions = string_lookup(hash_texts(list(texts[new_strings])), new_positions[new_strings])
+    idx = np.searchsorted(index.string_hashes, string_hashes)
+    merged_hashes = np.insert(np.asarray(index.string_hashes), idx, string_hashes)
+    merged_string_positions = np.insert(merged_positions(index.string_positions, points), idx, string_positions)
+
+    return RankIndex(np.insert(np.asarray(index.sort_keys), points, keys), merged_ranks,
+                     np.insert(np.asarray(index.is_string), points, is_string),
+                     np.insert(np.asarray(index.numbers), points, numbers), merged_offsets, merged_texts,
+                     merged_numbers, merged_number_positions, merged_hashes, merged_string_positions)
+
+
+def keeps_ranks(updated: RankIndex):
+    """
+    Returns whether the index returned by insert_global_ranks kept the ranks of the values already indexed. The
+    inserted ranks are fractional, so an index with integer ranks was ranked anew.
+    """
+    return updated.ranks.dtype.kind == 'f'
+
+
+def merged_positions(positions: ndarray, points: ndarray):
+    """Helper function that moves the positions of indexed values down by the number of new values inserted before"""
+    return np.asarray(positions) + np.searchsorted(points, positions, side='right')
+
+
+def insertion_points(index: RankIndex, keys: ndarray, texts: ndarray, is_string: ndarray):
+    """
+    Helper function that returns the number of indexed lines sorted before every new line, searching the lines with
+    the same leading number by their text as sort_n_sorted orders them
+    """
+    low = np.searchsorted(index.sort_keys, keys, side='left')
+    high = np.searchsorted(index.sort_keys, keys, side='right')
+    points = np.empty(len(keys), dtype=np.int64)
+    for k in range(len(keys)):
+        line = (texts[k], bool(is_string[k]))
+        lo, hi = low[k], high[k]
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if (index.text(mid), bool(index.is_string[mid])) < line:
+                lo = mid + 1
+            else:
+                hi = mid
+        points[k] = lo
+    return points
@@ -0,0 +1,153 @@
+import hashlib
+import os
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from pandas.util import hash_pandas_object
+
+# The version of the cache entries, changing it makes all the existing entries misses
+HISTOGRAM_CACHE_VERSION = 2
+
+HISTOGRAM_CACHE_DIR = 'cache/histograms'
+
+
+class HistogramCache(object):
+    """
+    A class used to cache the ranks and the quantile histograms of the columns on disk, keyed by the content of the
+    column, the number of quantiles and the version of the global ranks. A column with the same data is never
+    processed twice, whatever its name, and the entries of data or ranks that changed are never reused. The least
+    recently used entries are evicted when the cache grows over its size.
+
+    Attributes
+    ----------
+    path : str
+        the folder of the cache entries
+    max_size : int
+        the maximum size of the entries in bytes
+    hits : int
+        the number of entries found
+    misses : int
+        the number of entries not found
+    evictions : int
+        the number of entries evicted
+
+    Methods
+    -------
+    key(content: str, quantiles: int, rank_version: str)
+        Returns the key of a column's entry
+
+    get(key: str)
+        Returns the cached (ranks, bucket_boundaries, bucket_values, size, cardinality) or None
+
+    put(key: str, ranks, bucket_boundaries, bucket_values, size, cardinality)
+        Adds an entry and evicts the least recently used ones if the cache is full
+
+    stats()
+        Returns the hit, miss and eviction counts and the size of the cache
+    """
+    def __init__(self, path: str = HISTOGRAM_CACHE_DIR, max_size: int = 1 << 30):
+        """
+        Parameters
+        ----------
+        path : str, optional
+            the folder of the cache entries (default is cache/histograms)
+        max_size : int, optional
+            the maximum size of the entries in bytes (default is 1 GiB)
+        """
+        self.path = path
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if not os.path.exists(path):
+            os.makedirs(path)
+        entries = [(os.path.getmtime(os.path.join(path, file)), file[:-len('.npz')],
+                    os.path.getsize(os.path.join(path, file)))
+                   for file in os.listdir(path) if file.endswith('.npz')]
+        self.__entries = OrderedDict((key, size) for _, key, size in sorted(entries))  # least recently used first
+        self.__size = sum(self.__entries.values())
+
+    @staticmethod
+    def key(content: str, quantiles: int, rank_version: str):
+        """
+        Returns the key of a column's entry
+
+        Parameters
+        ----------
+        content : str
+            the hash of the column's data, see content_hash
+        quantiles : int
+            the number of quantiles of the histogram
+        rank_version : str
+            the version of the global ranks the column is ranked with, see global_ranks.rank_index_version
+        """
+        content = str((HISTOGRAM_CACHE_VERSION, content, quantiles, rank_version))
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    def __file(self, key: str):
+        return os.path.join(self.path, key + '.npz')
+
+    def get(self, key: str):
+        """Returns the cached (ranks, bucket_boundaries, bucket_values, size, cardinality) or None"""
+        if key not in self.__entries or not os.path.exists(self.__file(key)):
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.__entries.move_to_end(key)
+        os.utime(self.__file(key))
+        with np.load(self.__file(key)) as entry:
+            return (entry['ranks'], entry['bucket_boundaries'], entry['bucket_values'], int(entry['size']),
+                    int(entry['cardinality']))
+
+    def put(self, key: str, ranks, bucket_boundaries, bucket_values, size: int, cardinality: int):
+        """Adds an entry and evicts the least recently used ones if the cache is full"""
+        tmp_file = self.__file(key) + '.tmp'
+        with open(tmp_file, 'wb') as output:
+            np.savez(output, ranks=ranks, bucket_boundaries=bucket_boundaries, bucket_values=bucket_values,
+                     size=size, cardinality=cardinality)
+        os.replace(tmp_file, self.__file(key))
+        self.__size -= self.__entries.pop(key, 0)
+        self.__entries[key] = os.path.getsize(self.__file(key))
+        self.__size += self.__entries[key]
+        while self.__size > self.max_size and len(self.__entries) > 1:
+            evicted, size = self.__entries.popitem(last=False)
+            if os.path.exists(self.__file(evicted)):
+                os.remove(self.__file(evicted))
+            self.__size -= size
+            self.evictions += 1
+
+    def stats(self):
+        """Returns the hit, miss and eviction counts and the size of the cache"""
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'entries': len(self.__entries), 'size': self.__size}
+
+
+def content_hash(values, data_type=None, index: bool = False):
+    """
+    Returns a hash of the data of a column that does not depend on the order of the values. The object values are
+    hashed as text by pandas, so the type of every value is hashed with it, e.g. 0 and '0' have different hashes.
+
+    Parameters
+    ----------
+    values : pandas.Series
+        the data of the column, or its value counts with the distinct values as index
+    data_type : optional
+        the data type of the column
+    index : bool, optional
+        if true the index is part of the data, as in the value counts (default is False)
+    """
+    frame = pd.DataFrame({'values': values.to_numpy(), 'types': value_types(values)}, index=values.index)
+    if index:
+        frame['index_types'] = value_types(values.index)
+    hashes = np.sort(hash_pandas_object(frame, index=index).to_numpy())
+    digest = hashlib.sha256(str((data_type, len(hashes))).encode('utf-8'))
+    digest.update(hashes.tobytes())
+    return digest.hexdigest()
+
+
+def value_types(values):
+    """Returns the type name of every value, or the data type of the values if it is not object"""
+    if values.dtype != object:
+        return np.full(len(values), str(values.dtype), dtype=object)
+    return np.array([type(value).__name__ for value in values], dtype=object)
@@ -1,8 +1,33 @@
+from functools import lru_cache
+
 from numpy import ndarray
 import numpy as np
 import scipy.stats as ss
 
 
+@lru_cache(maxsize=None)
+def ground_distance_matrix(quantiles: int):
+    """
+    Returns the EMD ground distance matrix between the buckets of a histogram with the specified amount of quantiles
+
+    The matrix is built once per quantile count and shared by all the histograms of the process, so it is read-only.
+
+    Parameters
+    ----------
+    quantiles : int
+        the number of quantiles
+
+    Returns
+    -------
+    ndarray
+        a (quantiles, quantiles) matrix with the distances |i - j| / quantiles between the buckets i and j
+    """
+    q = np.arange(1, quantiles + 1) / quantiles
+    dist = np.abs(q[:, None] - q[None, :])
+    dist.setflags(write=False)
+    return dist
+
+
 class QuantileHistogram(object):
     """
     A class used to represent an equi depth quantile histogram
@@ -26,6 +51,9 @@ class QuantileHistogram(object):
     create_histogram_from_reference(column: list)
         Creates an equi depth quantile histogram for the specified column based on the reference histogram
 
+    from_buckets(name: str, bucket_boundaries: ndarray, bucket_values: ndarray, normalization: int)
+        Creates a histogram from already computed bucket boundaries and values
+
     get_buckets()
         Returns the histogram's buckets
 
@@ -40,8 +68,8 @@ class QuantileHistogram(object):
     copy_buckets_without_values()
         Copies the bucket boundaries but not the values
 
-     add_value_to_bucket(value: float)
-        Adds a value into a bucket
+     add_values(values: ndarray)
+        Adds all the values to their buckets at once
 
      normalize_buckets(column_size: int)
         Normalizes the frequencies inside the buckets based on the column size
@@ -63,12 +91,11 @@ class QuantileHistogram(object):
         reference_hist : QuantileHistogram, optional
             the reference histogram that provides the bucket boundaries
         """
-        self.bucket_boundaries = {}
-        self.bucket_values = {}
+        self.bucket_boundaries = np.empty((0, 2))
+        self.bucket_values = np.zeros(quantiles)
         self.name = name
         self.normalization_factor = normalization
         self.quantiles = quantiles
-        self.dist_matrix = self.calc_dist_matrix()
 
         if reference_hist is None:
             self.add_buckets(ranks.min(), ss.mstats.mquantiles(ranks, np.array(list(range(1, quantiles + 1))) / quantiles))
@@ -77,54 +104,76 @@ class QuantileHistogram(object):
             self.bucket_boundaries = reference_hist.bucket_boundaries
             self.add_values(ranks)
 
+    @classmethod
+    def from_buckets(cls, name: str, bucket_boundaries: ndarray, bucket_values: ndarray, normalization: int):
+        """
+        Creates a histogram from already computed bucket boundaries and normalized bucket values
+        """
+        histogram = cls.__new__(cls)
+        histogram.name = name
+        histogram.normalization_factor = normalization
+        histogram.quantiles = len(bucket_boundaries)
+        histogram.bucket_boundaries = bucket_boundaries
+        histogram.bucket_values = bucket_values
+        return histogram
+
+    @property
+    def dist_matrix(self):
+        return ground_distance_matrix(self.quantiles)
+
     @property
     def get_values(self):
-        return np.array(list(self.bucket_values.values()))
+        return self.bucket_values
 
     @property
     def is_empty(self):
         return np.sum(self.get_values) == 0
 
     def add_buckets(self, min_val, bb):
-        self.bucket_boundaries[0] = (min_val, bb[0])
-        i = 0
-        while i < len(bb) - 1:
-            self.bucket_boundaries[i+1] = (bb[i], bb[i+1])
-            i = i + 1
-        # self.bucket_boundaries[i] = (self.bucket_boundaries[i-1][1], math.inf)
+        bb = np.asarray(bb, dtype=float)
+        lower = np.concatenate(([min_val], bb[:-1]))
+        self.bucket_boundaries = np.ascontiguousarray(np.column_stack((lower, bb)))
 
     def add_values(self, values, norm=True):
-        for i in range(len(self.bucket_boundaries.values())):
-            self.bucket_values[i] = 0.0
-        for value in values:
-            idx = self.bucket_binary_search(value)
-            if idx != -1:
-                self.bucket_values[idx] = self.bucket_values[idx] + 1.0
+        self.bucket_values = self.bucket_counts(values)
         if norm:
             self.normalize_values()
 
+    def bucket_counts(self, values):
+        """Returns how many of the values fall in every bucket, without changing the histogram"""
+        idx = self.bucket_binary_search(np.asarray(values))
+        idx = idx[idx != -1]
+        return np.bincount(idx, minlength=len(self.bucket_boundaries)).astype(float)
+
     def normalize_values(self):
-        self.bucket_values = {k: v / self.normalization_factor for k, v in self.bucket_values.items()}
+        self.bucket_values = self.bucket_values / self.normalization_factor
 
     def bucket_binary_search(self, x):
-        lelf = 0
-        right = self.quantiles - 1
-        while lelf <= right:
-            mid = lelf + (right - lelf) // 2
-            if self.bucket_boundaries[mid][0] <= x <= self.bucket_boundaries[mid][1]:
-                return mid
-            elif self.bucket_boundaries[mid][1] < x:
-                lelf = mid + 1
-            else:
-                right = mid - 1
-        return -1
-
-    def calc_dist_matrix(self):
-        q = np.array(list(range(1, self.quantiles + 1))) / self.quantiles
-        dist = []
-        for i in q:
-            temp = []
-            for j in q:
-                temp.append(abs(i - j))
-            dist.append(temp)
-        return np.array(dist)
+        """
+        Finds the bucket of every value in x at once. Values outside the histogram get the index -1.
+
+        A value that lies on a boundary shared by several buckets goes to the bucket a scalar binary search over
+        [0, quantiles - 1] probes first, which keeps the histograms identical to the per-value search.
+        """
+        first = np.searchsorted(self.bucket_boundaries[:, 1], x, side='left')
+        last = np.searchsorted(self.bucket_boundaries[:, 0], x, side='right') - 1
+        idx = np.where(first <= last, first, -1)
+        ties = np.flatnonzero(first < last)
+        if len(ties) > 0:
+            idx[ties] = self.first_probed_bucket(first[ties], last[ties])
+        return idx
+
+    def first_probed_bucket(self, first, last):
+        left = np.zeros(len(first), dtype=int)
+        right = np.full(len(first), len(self.bucket_boundaries) - 1)
+        result = np.full(len(first), -1)
+        pending = np.ones(len(first), dtype=bool)
+        while pending.any():
+            mid = left + (right - left) // 2
+            hit = pending & (first <= mid) & (mid <= last)
+            result[hit] = mid[hit]
+            pending &= ~hit
+            go_right = mid < first
+            left = np.where(go_right, mid + 1, left)
+            right = np.where(go_right, right, mid - 1)
+        return result
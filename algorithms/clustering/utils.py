@@ -1,152 +1,277 @@
+import os
 import pickle
+from multiprocessing import Pool
 
+import numpy as np
+import pandas as pd
+from numpy import ndarray
+from tqdm import tqdm
 
 from algorithms.clustering.column_model import Column
-from algorithms.clustering.emd_utils import quantile_emd, intersection_emd
+from algorithms.clustering.column_store import ColumnStore
+from algorithms.clustering.emd_utils import reference_emd_many, ranks_intersection_emd_many
+from algorithms.clustering.global_ranks import get_rank_index, rank_index_version
+from algorithms.clustering.histogram_cache import HistogramCache, content_hash
+from algorithms.clustering.quantile_histogram.histogram import ground_distance_matrix
 from algorithms.clustering.quantile_histogram.histogram import QuantileHistogram
 
+# The relative slack between an EMD lower bound and the threshold that covers the rounding errors of the EMD solvers
+PRUNE_TOLERANCE = 1e-9
 
-def compute_cutoff_threshold(C: list, threshold: float):
+# The data type of the EMD matrices
+EMD_DTYPE = np.float32
+
+# The column store that process_emd reads, set once per process by init_process_emd
+worker_store = None
+
+
+def compute_cutoff_thresholds(A: ndarray, threshold: float):
     """
     Algorithm 1 of the paper "Automatic Discovery of Attributes in Relational Databases" from M. Zhang et al. [1]
     This algorithm computes the threshold of a column that determines if any other column is to be considered
-    its neighbour.
+    its neighbour. The thresholds of all the rows are computed at once: every row is sorted together with the global
+    threshold and the cutoff is the EMD before the first largest gap among the EMD values up to the global threshold,
+    or 0 if there is no gap.
 
     Parameters
     ---------
-    C : list
-        a list containing dicts of EMD/ColumnName pairs
+    A : ndarray
+        the rows of the EMD matrix of the columns, inf for the columns they are not compared with
     threshold : float
         the conservative global EMD cutoff threshold described in [1]
 
     Returns
     -------
-    float
-        the cutoff threshold of the input column
+    ndarray
+        the cutoff threshold of every row
     """
-    C.append({'e': threshold, 'c': 0})
-    C = sorted(C, key=lambda k: k['e'])
-    cutoff = 0.0
-    gap = 0.0
-    i = 0
-    while i < len(C) - 1 and C[i + 1]['e'] <= threshold:
-        if gap < (C[i + 1]['e'] - C[i]['e']):
-            gap = C[i + 1]['e'] - C[i]['e']
-            cutoff = C[i]['e']
-        i += 1
-    return cutoff
+    C = np.sort(np.column_stack((np.asarray(A, dtype=float), np.full(len(A), threshold))), axis=1)
+    if C.shape[1] < 2:
+        return np.zeros(len(C))
+    with np.errstate(invalid='ignore'):  # inf - inf of the columns that are not compared
+        gaps = np.diff(C, axis=1)
+    gaps[C[:, 1:] > threshold] = 0
+    first_max = np.argmax(gaps, axis=1)
+    rows = np.arange(len(C))
+    return np.where(gaps[rows, first_max] > 0, C[rows, first_max], 0.0)
+
+
+def cutoff_edges(A: ndarray, threshold: float, batch_size: int = 1024):
+    """
+    Computes the neighbours of every column with Algorithm 1, processing batch_size rows of the EMD matrix at a time
 
+    Parameters
+    ---------
+    A : ndarray
+        the EMD matrix of the columns
+    threshold : float
+        the conservative global EMD cutoff threshold described in [1]
+    batch_size : int, optional
+        the number of rows sorted at once (default is 1024)
 
-def column_combinations(columns: list, quantiles: int, intersection: bool = False):
+    Returns
+    -------
+    tuple
+        the arrays (rows, cols) with the edges from every column to its neighbours
     """
-    All the unique combinations between all the columns
+    rows = list()
+    cols = list()
+    for start in range(0, len(A), batch_size):
+        batch = A[start:start + batch_size]
+        cutoffs = compute_cutoff_thresholds(batch, threshold)
+        batch_rows, batch_cols = np.nonzero(batch <= cutoffs[:, np.newaxis])
+        rows.append(batch_rows + start)
+        cols.append(batch_cols)
+    if len(rows) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(rows), np.concatenate(cols)
+
+
+def column_combinations(columns: list):
+    """
+    All the unique combinations between the columns of different tables, grouped by their first column
 
     Parameters
     ---------
     columns : list
         a list that contains all the column names
-    quantiles : int
-        The number of quantiles that the histograms are split on
-    intersection : bool, optional
-        if true do the intersection EMD else the normal EMD
 
     Returns
     -------
-    tuple
-        a tuple with ((column_name1, column_name1), quantiles, intersection)
-    """
-    c = len(columns)
-    c_i = 0
-    while c_i < c:
-        name_i = columns[c_i]
-        table_i = name_i.split("__")[0]
-        c_j = c_i + 1
-        while c_j < c:
-            name_j = columns[c_j]
-            table_j = name_j.split("__")[0]
-            if table_i != table_j:
-                yield (name_i, name_j), quantiles, intersection
-            c_j = c_j + 1
-        c_i = c_i + 1
+    generator
+        (i, js) tuples with the position of a column and an array with the positions of the columns after it that
+        belong to other tables
+    """
+    tables = pd.factorize(pd.Series([name.split("__")[0] for name in columns], dtype=object))[0]
+    for i in range(len(columns)):
+        js = np.flatnonzero(tables[i + 1:] != tables[i]) + i + 1
+        if len(js) > 0:
+            yield i, js
 
 
-def process_emd(tup: tuple):
+def emd_lower_bounds(store: ColumnStore, i: int):
     """
-    Function defining a single quantile_emd process between two columns.
+    Lower bounds of the EMD between the quantile histogram of the column i and the histograms of all the columns
+    created over its bucket boundaries.
+
+    A column's ranks outside the range of the column i are not binned, so the two histograms carry different masses
+    and the EMD of pyemd pays the maximum ground distance for every unit of mass difference. The bound is infinite for
+    the columns without any rank in the range, whose EMD is infinite.
 
     Parameters
     ---------
-    tup : tuple
-        a tuple with k
+    store : ColumnStore
+        the ranks and histograms of the columns
+    i : int
+        the index of the column
+
+    Returns
+    -------
+    ndarray
+        the lower bound of the EMD between the column i and every column of the store
+    """
+    boundaries = store.bucket_boundaries[i]
+    in_range = store.count_in_range(boundaries[0, 0], boundaries[-1, 1])
+    mass_difference = np.abs(np.sum(store.bucket_values[i]) - in_range / store.sizes)
+    bounds = mass_difference * ground_distance_matrix(len(boundaries)).max()
+    bounds[in_range == 0] = np.inf
+    return bounds
+
+
+def prune_combinations(rows: list, ids: ndarray, store: ColumnStore, threshold: float):
+    """
+    Blocking stage that drops the column combinations whose EMD lower bound (see emd_lower_bounds) is above the
+    threshold. Algorithm 1 ignores the EMD values above the global threshold, so the distribution clusters are the
+    same with and without pruning.
+
+    Parameters
+    ---------
+    rows : list
+        the column combinations generated by column_combinations
+    ids : ndarray
+        the index in the store of the column at every position
+    store : ColumnStore
+        the ranks and histograms of the columns of the combinations
+    threshold : float
+        the conservative global EMD cutoff threshold described in [1]
 
     Returns
     -------
     tuple
-        a dictionary entry {k: joint key of the column combination, v: quantile_emd calculation}
+        the combinations that have to be computed and the number of pruned combinations
     """
-    name_i, name_j, k, quantile, intersection = unwrap_process_input_tuple(tup)
-    with open('cache/'+name_i+'.pkl', 'rb') as pkl_file:
-        c1 = pickle.load(pkl_file)
-    with open('cache/'+name_j+'.pkl', 'rb') as pkl_file:
-        c2 = pickle.load(pkl_file)
-    if intersection:
-        return k, intersection_emd(c1, c2, quantile)
-    else:
-        return k, quantile_emd(c1, c2, quantile)
+    kept = list()
+    pruned = 0
+    for i, js in rows:
+        keep = emd_lower_bounds(store, ids[i])[ids[js]] <= threshold * (1 + PRUNE_TOLERANCE)
+        pruned += int(np.count_nonzero(~keep))
+        if keep.any():
+            kept.append((i, js[keep]))
+    return kept, pruned
 
 
-def unwrap_process_input_tuple(tup: tuple):
+def process_emd(tup: tuple):
     """
-    Helper function that unwraps a tuple to its components and creates a unique key for the column combination
+    Function defining the quantile_emd processes between a column and the columns it is combined with, which are
+    computed in one batch
 
     Parameters
     ---------
     tup : tuple
-        the tuple to unwrap
+        a tuple with the store index of the column, the store indexes of the other columns, whether to compute the
+        intersection EMD and the EMD backend
+
+    Returns
+    -------
+    ndarray
+        the quantile_emd calculations of the column combinations
     """
-    names, quantile, intersection = tup
-    name_i, name_j = names
-    k = str(name_i) + "|" + str(name_j)
-    return name_i, name_j, k, quantile, intersection
+    i, js, intersection, backend = tup
+    if intersection:
+        return ranks_intersection_emd_many(worker_store.get_histogram(i), worker_store.get_ranks(i),
+                                           [worker_store.get_histogram(j) for j in js],
+                                           [worker_store.get_ranks(j) for j in js], backend)
+    else:
+        return reference_emd_many(worker_store.get_histogram(i), [worker_store.get_ranks(j) for j in js],
+                                  worker_store.sizes[js], backend)
 
 
-def insert_to_dict(dc: dict, k: str, v: dict):
+def init_process_emd(store):
     """
-    Helper function that instantiates a list to a dictionary key if it is not present and then appends an
-    EMD/ColumnName pair to it
+    Initializer of the processes computing the EMD that sets the column store they read
 
     Parameters
     ---------
-    dc : dict
-        the dictionary
-    k : str
-        the key
-    v : dict
-         EMD/ColumnName pair
+    store : ColumnStore or str
+        the ranks and histograms of the columns, or the folder of a saved store that is memory-mapped
+    """
+    global worker_store
+    worker_store = ColumnStore.load(store) if isinstance(store, str) else store
+
+
+def worker_store_argument(store: ColumnStore):
     """
-    if k not in dc:
-        dc[k] = list()
-    dc[k].append(v)
+    Helper function that returns what init_process_emd gets from a process pool: the folder of a saved store, which
+    the workers memory-map instead of unpickling a copy of it each, or the store itself if it is only in memory
+    """
+    return store.path if store.path is not None else store
 
 
-def transform_dict(dc: dict):
+def compute_emd(rows: list, ids: ndarray, store: ColumnStore, intersection: bool = False, backend: str = 'pyemd',
+                processes: int = 1, chunk_size: int = None, pool: Pool = None):
     """
-    Helper function that transforms a dict with composite column combination keys to a dict with column keys and
-    values EMD/ColumnName pairs in a sorted list (ascending based on the EMD value)
+    Runs process_emd over the rows of column combinations either serially or in a process pool and writes the EMD
+    values in a symmetric matrix indexed by the position of the columns as they arrive. The pairs that are not
+    computed (the column itself, columns of the same table and pruned combinations) are inf. The workers memory-map
+    the column store if it is saved, see worker_store_argument.
 
     Parameters
     ---------
-    dc : dict
-        the dictionary
+    rows : list
+        the column combinations generated by column_combinations
+    ids : ndarray
+        the index in the store of the column at every position
+    store : ColumnStore
+        the ranks and histograms of the columns of the combinations
+    intersection : bool, optional
+        if true do the intersection EMD else the normal EMD (default is False)
+    backend : str, optional
+        the EMD engine, one of emd_utils.EMD_BACKENDS (default is 'pyemd')
+    processes : int, optional
+        the number of worker processes, 1 runs in the current process and None uses all the cores (default is 1)
+    chunk_size : int, optional
+        the number of rows sent to a worker at once (default splits the work in 4 chunks per worker)
+    pool : multiprocessing.Pool, optional
+        a pool of processes processes initialized with init_process_emd over the store, used instead of starting a
+        new one (default starts a new pool)
+
+    Returns
+    -------
+    ndarray
+        a (columns, columns) EMD_DTYPE matrix
     """
-    tmp_dict = dict()
-    for k, v in dc.items():
-        k1, k2 = k.split("|")
-        v1 = {'e': v, 'c': k2}
-        v2 = {'e': v, 'c': k1}
-        insert_to_dict(tmp_dict, k1, v1)
-        insert_to_dict(tmp_dict, k2, v2)
-    return tmp_dict
+    A = np.full((len(ids), len(ids)), np.inf, dtype=EMD_DTYPE)
+    tasks = ((ids[i], ids[js], intersection, backend) for i, js in rows)
+    total = len(rows)
+    if processes == 1:
+        init_process_emd(store)
+        fill_emd_matrix(A, rows, map(process_emd, tasks), total)
+        return A
+    if chunk_size is None:
+        chunk_size = max(1, total // ((processes or os.cpu_count()) * 4))
+    if pool is not None:
+        fill_emd_matrix(A, rows, pool.imap(process_emd, tasks, chunksize=chunk_size), total)
+        return A
+    with Pool(processes, initializer=init_process_emd, initargs=(worker_store_argument(store),)) as pool:
+        fill_emd_matrix(A, rows, pool.imap(process_emd, tasks, chunksize=chunk_size), total)
+    return A
+
+
+def fill_emd_matrix(A: ndarray, rows: list, results, total: int):
+    """Helper function that writes the EMD values of every row of column combinations in A as they arrive"""
+    for (i, js), emds in zip(rows, tqdm(results, total=total)):
+        A[i, js] = emds
+        A[js, i] = emds
 
 
 def process_columns(tup: tuple):
@@ -156,39 +281,165 @@ def process_columns(tup: tuple):
     Parameters
     ---------
     tup : tuple
-        tuple containing the information of the column to be processed
+        tuple containing the information of the column to be processed and the HistogramCache or None
     """
-    column_name, data, source_name, data_type, quantiles = tup
+    column_name, data, source_name, data_type, quantiles, histogram_cache = tup
+    key = None
+    if histogram_cache is not None:
+        key = histogram_cache.key(content_hash(data, str(data_type)), quantiles, rank_index_version())
+        column = load_cached_column(histogram_cache, key, column_name, source_name, data_type, quantiles)
+        if column is not None:
+            save_column(column)
+            return
     column = Column(column_name, data, source_name, data_type, quantiles)
+    cache_column(column, quantiles, histogram_cache, key)
+
+
+def process_value_counts(tup: tuple):
+    """
+    Process the value counts of a column, as computed by stream_column_counts, to a column_model_scale.Column
+
+    Parameters
+    ---------
+    tup : tuple
+        tuple containing the information of the column to be processed and the HistogramCache or None
+    """
+    column_name, counts, source_name, data_type, quantiles, histogram_cache = tup
+    key = None
+    if histogram_cache is not None:
+        key = histogram_cache.key(content_hash(counts, str(data_type), index=True), quantiles, rank_index_version())
+        column = load_cached_column(histogram_cache, key, column_name, source_name, data_type, quantiles)
+        if column is not None:
+            save_column(column)
+            return
+    non_empty = counts[[value != '' for value in counts.index]]  # remove the empty strings
+    ranks = np.sort(np.repeat(get_rank_index().lookup(list(non_empty.index)), non_empty.to_numpy()))
+    column = Column.from_ranks(column_name, ranks, source_name, data_type, quantiles, len(counts),
+                               int(counts.sum()))
+    cache_column(column, quantiles, histogram_cache, key)
+
+
+def load_cached_column(histogram_cache: HistogramCache, key: str, column_name: str, source_name: str, data_type,
+                       quantiles: int):
+    """
+    Creates a column_model_scale.Column from the ranks and the histogram cached under the key
+
+    Returns
+    -------
+    Column
+        the column or None if the key is not in the cache
+    """
+    cached = histogram_cache.get(key)
+    if cached is None:
+        return None
+    ranks, bucket_boundaries, bucket_values, size, cardinality = cached
+    column = Column.from_ranks(column_name, ranks, source_name, data_type, quantiles, cardinality, size)
+    column.quantile_histogram = QuantileHistogram.from_buckets(column.get_long_name(), bucket_boundaries,
+                                                               bucket_values, size)
+    return column
+
+
+def cache_column(column: Column, quantiles: int, histogram_cache: HistogramCache = None, key: str = None):
+    """
+    Computes the quantile histogram of a column and stores the column as a pickle file
+
+    Parameters
+    ---------
+    column : Column
+        the column to be processed
+    quantiles : int
+        the number of quantiles of the histogram
+    histogram_cache : HistogramCache, optional
+        the cache that keeps the ranks and the histogram under the key (default is None)
+    key : str, optional
+        the key of the column in the histogram cache
+    """
     print("Processing column: ", column.get_long_name())
     column.quantile_histogram = QuantileHistogram(column.get_long_name(), column.ranks, column.size, quantiles)
+    if histogram_cache is not None:
+        histogram_cache.put(key, column.ranks, column.quantile_histogram.bucket_boundaries,
+                            column.quantile_histogram.get_values, column.size, column.cardinality)
+    save_column(column)
+
+
+def save_column(column: Column):
+    """Stores the column of the current run as the pickle file cache/<long name>.pkl"""
     with open('cache/' + column.get_long_name() + '.pkl', 'wb') as output:
         pickle.dump(column, output, pickle.HIGHEST_PROTOCOL)
 
 
-def parallel_cutoff_threshold(tup: tuple):
+def stream_column_counts(file_path: str, chunk_size: int = 100000):
     """
-    Process the cutoff threshold in parallel for each column
+    Reads a csv file in chunks and accumulates the value counts of every column, so that the memory needed is bounded
+    by the distinct values of the columns instead of the size of the table.
+
+    The cells are read as text and every column is typed at the end from all its distinct values, the same way
+    pandas.read_csv types a column from the whole file, so the values do not depend on the chunk they were read in.
+    The missing values are filled with 0.
 
     Parameters
     ---------
-    tup : tuple
-        tuple containing the information of the column to be processed
-    """
-    A, column, threshold = tup
-    name_i = column.get_long_name()
-    theta = compute_cutoff_threshold(A[name_i], threshold)
-    print("Cutoff threshold for ", name_i, " is ", theta)
-    Nc = [(name_i, i['c']) for i in A[name_i] if i['e'] <= theta]
-    return Nc
-
+    file_path : str
+        the path of the csv file
+    chunk_size : int, optional
+        the number of rows read at once (default is 100000)
 
-def cuttoff_column_generator(A: dict, columns: list, threshold: float):
+    Returns
+    -------
+    dict
+        a dictionary with the column names as keys and (value counts, data type) tuples as values, where the value
+        counts are a pandas.Series with the distinct values as index
     """
-    Generator of columns for the cutoff threshold computation
+    counts = dict()
+    missing = dict()
+    for chunk in pd.read_csv(file_path, index_col=False, dtype=object, chunksize=chunk_size):
+        for column_name in chunk.columns:
+            if column_name not in counts:
+                counts[column_name] = list()
+                missing[column_name] = 0
+            counts[column_name].append(chunk[column_name].value_counts(sort=False))
+            missing[column_name] += int(chunk[column_name].isna().sum())
+            # the chunk counts are merged once they outgrow the merged counts, so every value is merged a few times
+            if sum(map(len, counts[column_name][1:])) > max(len(counts[column_name][0]), chunk_size):
+                counts[column_name] = [merge_value_counts(counts[column_name])]
+    return {column_name: type_value_counts(merge_value_counts(counts[column_name]), missing[column_name])
+            for column_name in counts}
+
+
+def merge_value_counts(counts: list):
+    """Helper function that sums value counts with the same values"""
+    if len(counts) == 1:
+        return counts[0]
+    return pd.concat(counts).groupby(level=0, sort=False).sum()
+
+
+def type_value_counts(counts: pd.Series, missing: int):
     """
-    for column_name in columns:
-        with open('cache/' + column_name + '.pkl', 'rb') as pkl_file:
-            column = pickle.load(pkl_file)
-        yield A, column, threshold
+    Helper function that converts the text values of a column's value counts to booleans or numbers when all of them
+    can be converted and adds the missing values as 0
+
+    Parameters
+    ---------
+    counts : pandas.Series
+        the value counts of the text values
+    missing : int
+        the number of missing values
 
+    Returns
+    -------
+    tuple
+        the typed value counts and the data type of the column
+    """
+    texts = counts.index.astype(str)
+    numbers = pd.to_numeric(pd.Series(texts), errors='coerce')
+    if len(texts) > 0 and texts.isin(['True', 'TRUE', 'true', 'False', 'FALSE', 'false']).all():
+        values, data_type = list(texts.isin(['True', 'TRUE', 'true'])), np.dtype(bool)
+    elif len(texts) > 0 and numbers.notna().all():
+        data_type = np.dtype(np.int64 if missing == 0 and texts.str.match(r'^\s*[-+]?\d+\s*$').all() else float)
+        values = list(numbers.astype(data_type))
+    else:
+        values, data_type = list(counts.index), np.dtype(object)
+    typed = pd.Series(counts.to_numpy(dtype=np.int64), index=pd.Index(values, dtype=object))
+    if missing > 0:
+        typed = pd.concat([typed, pd.Series([missing], index=pd.Index([0], dtype=object))])
+    return typed.groupby(level=0, sort=False).sum(), data_type
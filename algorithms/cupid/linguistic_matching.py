@@ -1,9 +1,12 @@
 import math
-import operator
+import re
 import string
+from functools import lru_cache
 from itertools import product
+from multiprocessing import Pool
 
 import nltk
+import numpy as np
 import snakecase as snakecase
 from anytree import LevelOrderIter
 from nltk.corpus import stopwords
@@ -11,45 +14,101 @@ from nltk.corpus import wordnet as wn
 from similarity.ngram import NGram
 
 from algorithms.cupid.elements import SchemaElement, Token, TokenTypes
+from algorithms.cupid.wordnet_cache import WordNetCache
+
+# the WordNet similarity of the token pairs, replaced by use_wordnet_cache
+wordnet_cache = WordNetCache()
+
+# the tokenizer of the element names, set by use_tokenizer
+TOKENIZERS = ('nltk', 'regex')
+tokenizer = 'nltk'
+
+# the words, numbers and punctuation of an identifier, the underscores are split by snakecase afterwards
+IDENTIFIER_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+# the token similarity of every pair of the vocabulary, vocabulary_matrix[vocabulary_index[t1], vocabulary_index[t2]],
+# set by build_vocabulary for the schemas of one tree_match call
+vocabulary_index = dict()
+vocabulary_matrix = np.empty((0, 0))
+
+# the tokens of the rows computed by process_token_similarities, set by init_token_similarities
+similarity_words = list()
+
+
+def use_wordnet_cache(max_size=100000, path=None):
+    """
+    Replaces the WordNet similarity cache, e.g. to keep the computed token pairs in an sqlite file reused by
+    later runs
+    """
+    global wordnet_cache
+    wordnet_cache.flush()
+    wordnet_cache = WordNetCache(max_size, path)
+
+
+def use_tokenizer(name='nltk'):
+    """
+    Sets the tokenizer of the element names, 'nltk' for nltk.word_tokenize or 'regex' for a lightweight identifier
+    tokenizer that splits the names on whitespace and punctuation
+    """
+    global tokenizer
+    if name not in TOKENIZERS:
+        raise ValueError("Unknown tokenizer '{}', expected one of {}".format(name, TOKENIZERS))
+    tokenizer = name
+
+
+def tokenize(element, tokenizer_name):
+    if tokenizer_name == 'regex':
+        return IDENTIFIER_PATTERN.findall(element)
+    return nltk.word_tokenize(element)
+
+
+@lru_cache(maxsize=None)
+def english_stopwords():
+    return frozenset(stopwords.words('english'))
 
 
 def normalization(element, schema_element=None):
     if schema_element is None:
         schema_element = SchemaElement(element)
 
-    tokens = nltk.word_tokenize(element)
-
-    for token in tokens:
+    for data, token_type, ignore in normalized_tokens(element, tokenizer):
         token_obj = Token()
+        token_obj.data = data
+        token_obj.token_type = token_type
+        token_obj.ignore = ignore
+        schema_element.add_token(token_obj)
+
+    return schema_element
+
 
+@lru_cache(maxsize=100000)
+def normalized_tokens(element, tokenizer_name):
+    """
+    Returns the (data, token_type, ignore) of the tokens of an element name. The result is cached by name, since the
+    same names and data types are normalized over and over, and normalization copies it into new tokens because the
+    schema elements are changed after their creation.
+    """
+    tokens = list()
+
+    for token in tokenize(element, tokenizer_name):
         if token in string.punctuation:
-            token_obj.ignore = True
-            token_obj.data = token
-            token_obj.token_type = TokenTypes.SYMBOLS
-            schema_element.add_token(token_obj)
+            tokens.append((token, TokenTypes.SYMBOLS, True))
         else:
             try:
                 float(token)
-                token_obj.data = token
-                token_obj.token_type = TokenTypes.NUMBER
-                schema_element.add_token(token_obj)
+                tokens.append((token, TokenTypes.NUMBER, False))
             except ValueError:
                 token_snake = snakecase.convert(token)
 
                 if '_' in token_snake:
                     token_snake = token_snake.replace('_', ' ')
-                    schema_element = normalization(token_snake, schema_element)
-                elif token.lower() in stopwords.words('english'):
-                    token_obj.data = token.lower()
-                    token_obj.ignore = True
-                    token_obj.token_type = TokenTypes.COMMON_WORDS
-                    schema_element.add_token(token_obj)
+                    tokens.extend(normalized_tokens(token_snake, tokenizer_name))
+                elif token.lower() in english_stopwords():
+                    tokens.append((token.lower(), TokenTypes.COMMON_WORDS, True))
                 else:
-                    token_obj.data = token.lower()
-                    token_obj.token_type = TokenTypes.CONTENT
-                    schema_element.add_token(token_obj)
+                    tokens.append((token.lower(), TokenTypes.CONTENT, False))
 
-    return schema_element
+    return tuple(tokens)
 
 
 def compute_compatibility(categories1, categories2):
@@ -73,28 +132,22 @@ def compute_compatibility(categories1, categories2):
 
 
 def comparison(source_tree, target_tree, categories_source, categories_target, compatibility_table, th_ns):
-    all_nodes_s = [node.name for node in LevelOrderIter(source_tree)]
-    all_nodes_t = [node.name for node in LevelOrderIter(target_tree)]
-    all_nodes = product(all_nodes_s, all_nodes_t)
-
-    keys_source = categories_source.keys()
-    keys_target = categories_target.keys()
+    # the categories can hold elements that are not in the trees, so only the elements of the trees are compared
+    nodes_s = {id(node.name) for node in LevelOrderIter(source_tree)}
+    nodes_t = {id(node.name) for node in LevelOrderIter(target_tree)}
+    elements_s = {cat: [e for e in elements if id(e) in nodes_s] for cat, elements in categories_source.items()}
+    elements_t = {cat: [e for e in elements if id(e) in nodes_t] for cat, elements in categories_target.items()}
+
+    # every pair of elements of compatible categories, once even if several of their categories are compatible
+    compatible_pairs = dict()
+    for cat_s, cat_t in product(elements_s.keys(), elements_t.keys()):
+        if compatibility_table[cat_s][cat_t] > th_ns:
+            compatible_pairs.update(dict.fromkeys(product(elements_s[cat_s], elements_t[cat_t])))
 
-    name_sim = dict()
     lsim = dict()
-
-    for cat_s in keys_source:
-        for cat_t in keys_target:
-            if compatibility_table[cat_s][cat_t] > th_ns:
-                all_compatible_nodes = product(categories_source[cat_s], categories_target[cat_t])
-                name_sim = {pair: name_similarity_elements(pair[0], pair[1]) for pair in all_compatible_nodes if pair in all_nodes}
-
-    for s, t in name_sim.keys():
-        s_cat = s.categories
-        t_cat = t.categories
-        maxs = [max(dict(filter(lambda x: x[0] in t_cat, compatibility_table[c].items())).items(),
-                    key=operator.itemgetter(1))[1] for c in s_cat]
-        lsim[(s, t)] = name_sim[(s, t)] * max(maxs)
+    for s, t in compatible_pairs:
+        name_sim = name_similarity_elements(s, t)
+        lsim[(s, t)] = name_sim * max(compatibility_table[c_s][c_t] for c_s in s.categories for c_t in t.categories)
 
     return lsim
 
@@ -108,13 +161,17 @@ def name_similarity_tokens(token_set1, token_set2):
 
 
 def get_partial_similarity(token_set1, token_set2, n=2):
+    indexes1 = [vocabulary_index.get(t.data) for t in token_set1]
+    indexes2 = [vocabulary_index.get(t.data) for t in token_set2]
+    if n == 2 and len(token_set2) > 0 and None not in indexes1 and None not in indexes2:
+        # look the similarities up in the vocabulary matrix, summed in the same order as below
+        return sum(vocabulary_matrix[np.ix_(indexes1, indexes2)].max(axis=1).tolist(), 0)
+
     total_sum = 0
     for t1 in token_set1:
         max_sim = -math.inf
         for t2 in token_set2:
-            sim = compute_similarity_wordnet(t1.data, t2.data)
-            if math.isnan(sim):
-                sim = 1 - compute_similarity_ngram(t1.data, t2.data, n)
+            sim = token_similarity(t1.data, t2.data, n)
 
             if sim > max_sim:
                 max_sim = sim
@@ -124,10 +181,83 @@ def get_partial_similarity(token_set1, token_set2, n=2):
     return total_sum
 
 
+def token_similarity(word1, word2, n=2):
+    sim = compute_similarity_wordnet(word1, word2)
+    if math.isnan(sim):
+        sim = 1 - compute_similarity_ngram(word1, word2, n)
+    return sim
+
+
+def process_token_similarities(i):
+    word = similarity_words[i]
+    return [token_similarity(word, other) for other in similarity_words], wordnet_cache.take_computed()
+
+
+def init_token_similarities(words, worker=True):
+    global similarity_words
+    similarity_words = words
+    if worker:
+        wordnet_cache.detach()
+
+
+def build_vocabulary(tokens, processes=1):
+    """
+    Computes the similarity of every pair of the tokens, so that get_partial_similarity looks the similarities of the
+    vocabulary tokens up instead of computing them for every element pair. The matrix only holds the given tokens,
+    e.g. the vocabulary of the two schemas of a tree_match call, until clear_vocabulary. The rows are computed in a
+    process pool if processes is not 1, which gets the tokens once through its initializer.
+    """
+    global vocabulary_index, vocabulary_matrix
+
+    words = sorted(set(tokens))
+    matrix = np.empty((len(words), len(words)))
+    if processes == 1:
+        init_token_similarities(words, worker=False)
+        fill_vocabulary_rows(matrix, map(process_token_similarities, range(len(words))))
+        init_token_similarities(list(), worker=False)
+    else:
+        with Pool(processes, initializer=init_token_similarities, initargs=(words,)) as pool:
+            chunk_size = max(1, len(words) // (4 * processes))
+            fill_vocabulary_rows(matrix, pool.imap(process_token_similarities, range(len(words)), chunk_size))
+
+    vocabulary_index = {word: i for i, word in enumerate(words)}
+    vocabulary_matrix = matrix
+
+
+def fill_vocabulary_rows(matrix, results):
+    for i, (row, computed) in enumerate(results):
+        matrix[i] = row
+        # the WordNet similarities computed by the workers are added to the cache of this process
+        for word1, word2, sim in computed:
+            wordnet_cache.put(word1, word2, sim)
+
+
+def clear_vocabulary():
+    global vocabulary_index, vocabulary_matrix
+    vocabulary_index = dict()
+    vocabulary_matrix = np.empty((0, 0))
+
+
+def schema_vocabulary(source_tree, target_tree, categories_source, categories_target):
+    tokens = set()
+    for tree in [source_tree, target_tree]:
+        for node in LevelOrderIter(tree):
+            tokens.update(node.name.get_tokens_data())
+            if node.name.data_type is not None:
+                tokens.update(normalization(node.name.data_type).get_tokens_data())
+    for category in list(categories_source) + list(categories_target):
+        tokens.update(nltk.word_tokenize(category))
+    return tokens
+
+
 # the higher, the better
 def compute_similarity_wordnet(word1, word2):
-    allsyns1 = set(ss for ss in wn.synsets(word1))
-    allsyns2 = set(ss for ss in wn.synsets(word2))
+    return wordnet_cache.get(word1, word2, wordnet_similarity)
+
+
+def wordnet_similarity(word1, word2):
+    allsyns1 = get_synsets(word1)
+    allsyns2 = get_synsets(word2)
 
     if len(allsyns1) == 0 or len(allsyns2) == 0:
         return math.nan
@@ -138,6 +268,11 @@ def compute_similarity_wordnet(word1, word2):
     return best
 
 
+@lru_cache(maxsize=None)
+def get_synsets(word):
+    return frozenset(ss for ss in wn.synsets(word))
+
+
 # the lower, the better
 def compute_similarity_ngram(word1, word2, n):
     ngram = NGram(n)
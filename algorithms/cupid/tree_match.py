@@ -6,7 +6,8 @@ from operator import getitem
 from anytree import PostOrderIter, LevelOrderIter
 
 from algorithms.cupid.elements import SchemaElement
-from algorithms.cupid.linguistic_matching import name_similarity_elements, normalization, compute_lsim, compute_compatibility, comparison
+from algorithms.cupid.linguistic_matching import name_similarity_elements, normalization, compute_lsim, compute_compatibility, comparison, \
+    build_vocabulary, clear_vocabulary, schema_vocabulary
 from algorithms.cupid.structural_similarity import compute_ssim, change_structural_similarity
 
 
@@ -15,12 +16,16 @@ def compute_weighted_similarity(ssim, lsim, w_struct=0.5):
 
 
 def tree_match(source_tree, target_tree, categories, leaf_w_struct=0.5, w_struct=0.6, th_accept=0.14, th_high=0.15,
-               th_low=0.13, c_inc=1.2, c_dec=0.9, th_ns=0.4):
+               th_low=0.13, c_inc=1.2, c_dec=0.9, th_ns=0.4, processes=1):
+    build_vocabulary(schema_vocabulary(source_tree, target_tree, categories[source_tree.name.initial_name].keys(),
+                                        categories[target_tree.name.initial_name].keys()), processes)
 
     compatibility_table = compute_compatibility(categories[source_tree.name.initial_name].keys(),
                                                 categories[target_tree.name.initial_name].keys())
     lsims = comparison(source_tree, target_tree, categories[source_tree.name.initial_name],
                        categories[target_tree.name.initial_name], compatibility_table, th_ns)
+    # the name similarities of the elements are all in lsims, the vocabulary of the schemas is not needed anymore
+    clear_vocabulary()
 
     s_leaves = list(map(lambda n: n.name, source_tree.leaves))
     t_leaves = list(map(lambda n: n.name, target_tree.leaves))
@@ -28,9 +33,10 @@ def tree_match(source_tree, target_tree, categories, leaf_w_struct=0.5, w_struct
     sims = dict()
 
     start = time.time()
+    data_type_sims = compute_data_type_similarities(s_leaves, t_leaves)
     for s, t in all_leaves:
         # data type compatibility: max = 0.5
-        ssim = name_similarity_elements(normalization(s.data_type), normalization(t.data_type))
+        ssim = data_type_sims[(s.data_type, t.data_type)]
         # lsim = compute_lsim(s, t)
         if (s, t) not in lsims:
             lsims[(s, t)] = 0
@@ -81,6 +87,14 @@ def tree_match(source_tree, target_tree, categories, leaf_w_struct=0.5, w_struct
     return sims
 
 
+def compute_data_type_similarities(s_leaves, t_leaves):
+    # there are only a few distinct data types, so their similarities are computed once instead of for every leaf pair
+    s_data_types = {s.data_type: normalization(s.data_type) for s in s_leaves}
+    t_data_types = {t.data_type: normalization(t.data_type) for t in t_leaves}
+    return {(s_type, t_type): name_similarity_elements(s_element, t_element)
+            for s_type, s_element in s_data_types.items() for t_type, t_element in t_data_types.items()}
+
+
 def recompute_wsim(source_tree, target_tree, sims, w_struct=0.6, th_accept=0.14):
     s_post_order = [node for node in PostOrderIter(source_tree)]
     t_post_order = [node for node in PostOrderIter(target_tree)]
@@ -0,0 +1,134 @@
+import atexit
+import math
+import os
+import sqlite3
+from collections import OrderedDict
+
+
+class WordNetCache:
+    """
+    A cache of the WordNet similarity of token pairs. The most recently used pairs are kept in memory, up to
+    max_size pairs, and when a path is given every computed pair is also kept in an sqlite file that later runs
+    reuse.
+
+    Attributes
+    ----------
+    max_size : int
+        the maximum number of pairs kept in memory
+    path : str
+        the sqlite file of the persistent tier, None keeps the pairs only in memory
+    hits : int
+        the number of pairs found in memory or on disk
+    misses : int
+        the number of pairs computed
+
+    Methods
+    -------
+    get(word1, word2, compute)
+        Returns the similarity of the pair, computing it with compute(word1, word2) if it is not cached
+
+    put(word1, word2, sim)
+        Adds the similarity of a pair computed elsewhere, e.g. by a worker process
+
+    detach()
+        Makes the cache of a worker process keep the pairs it computes for take_computed instead of writing them
+
+    take_computed()
+        Returns and forgets the pairs computed since the cache was detached
+
+    flush()
+        Writes the pairs computed since the last flush to the persistent tier
+    """
+    def __init__(self, max_size=100000, path=None):
+        self.max_size = max_size
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.__memory = OrderedDict()
+        self.__pending = list()
+        self.__computed = None
+        # sqlite connections cannot be used across fork, so every process opens its own when it first needs it
+        self.__connection = None
+        self.__pid = None
+        if path is not None:
+            directory = os.path.dirname(path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            self.__connect()
+            atexit.register(self.flush)
+
+    def __connect(self):
+        if self.path is None:
+            return None
+        if self.__pid != os.getpid():
+            self.__pid = os.getpid()
+            self.__connection = sqlite3.connect(self.path)
+            self.__connection.execute('CREATE TABLE IF NOT EXISTS similarity '
+                                      '(word1 TEXT, word2 TEXT, sim REAL, PRIMARY KEY (word1, word2))')
+        return self.__connection
+
+    def get(self, word1, word2, compute):
+        key = (word1, word2)
+        if key in self.__memory:
+            self.hits += 1
+            self.__memory.move_to_end(key)
+            return self.__memory[key]
+
+        sim = self.__load(key)
+        if sim is None:
+            self.misses += 1
+            sim = compute(word1, word2)
+            if self.__computed is not None:
+                self.__computed.append((word1, word2, sim))
+            else:
+                self.__persist(word1, word2, sim)
+        else:
+            self.hits += 1
+
+        self.__remember(key, sim)
+        return sim
+
+    def put(self, word1, word2, sim):
+        key = (word1, word2)
+        if key not in self.__memory:
+            self.__persist(word1, word2, sim)
+        self.__remember(key, sim)
+
+    def __remember(self, key, sim):
+        self.__memory[key] = sim
+        self.__memory.move_to_end(key)
+        if len(self.__memory) > self.max_size:
+            self.__memory.popitem(last=False)
+
+    def __persist(self, word1, word2, sim):
+        if self.path is not None:
+            self.__pending.append((word1, word2, None if math.isnan(sim) else sim))
+            if len(self.__pending) >= 1000:
+                self.flush()
+
+    def __load(self, key):
+        connection = self.__connect()
+        if connection is None:
+            return None
+        row = connection.execute('SELECT sim FROM similarity WHERE word1 = ? AND word2 = ?', key).fetchone()
+        if row is None:
+            return None
+        return math.nan if row[0] is None else row[0]
+
+    def detach(self):
+        # the pool workers do not run atexit, so the parent persists the pairs they compute
+        self.__pending = list()
+        self.__computed = list()
+
+    def take_computed(self):
+        computed = self.__computed or list()
+        if self.__computed is not None:
+            self.__computed = list()
+        return computed
+
+    def flush(self):
+        if self.__computed is None and len(self.__pending) > 0:
+            connection = self.__connect()
+            connection.executemany('INSERT OR REPLACE INTO similarity VALUES (?, ?, ?)', self.__pending)
+            connection.commit()
+            self.__pending = list()
@@ -1,66 +1,54 @@
-import subprocess
-import time
-
-import pandas as pd
 import os
-import sys
-import shutil
 import pickle
+import sys
 
 from algorithms.clustering.correlation_clustering import CorrelationClustering
+from algorithms.clustering.global_ranks import build_global_ranks
+from algorithms.clustering.histogram_cache import HistogramCache
+from algorithms.clustering.utils import stream_column_counts
 
 
-def convert_data_type(string: str):
-    try:
-        f = float(string)
-        if f.is_integer():
-            return int(f)
-        return f
-    except ValueError:
-        return string
-
-
-def generate_global_ranks(path):
-    all_data = []
+def read_tables(path: str, chunk_size: int = 100000):
     for root, dirs, files in os.walk(os.path.join(path)):
         for file in files:
-            table = pd.read_csv(root + "/" + file, index_col=False).fillna(0)
-            for (_, column_data) in table.iteritems():
-                all_data.extend(column_data)
-    ranks = unix_sort_ranks(set(all_data))
-
-    with open('cache/global_ranks/ranks.pkl', 'wb') as output:
-        pickle.dump(ranks, output, pickle.HIGHEST_PROTOCOL)
-
-
-def unix_sort_ranks(corpus):
-
-    with open("./cache/sorts/unsorted_file.txt", 'w') as out:
-        for var in corpus:
-            print(str(var), file=out)
-
-    proc = subprocess.Popen(['sort -n cache/sorts/unsorted_file.txt > cache/sorts/sorted_file.txt'],
-                            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
-    time.sleep(1)
-    proc.terminate()
-    proc.communicate()
+            yield str(file.split(".")[0]), stream_column_counts(root + "/" + file, chunk_size)
 
-    rank = 1
-    ranks = []
 
-    with open('./cache/sorts/sorted_file.txt', 'r') as f:
-        txt = f.read()
-        for var in txt.splitlines():
-            ranks.append((convert_data_type(var.replace('\n', '')), rank))
-            rank = rank + 1
-
-    shutil.rmtree('./cache/sorts')
-    os.mkdir('./cache/sorts')
-
-    return dict(ranks)
-
-
-def load_dataset(path: str, threshold1: float, threshold2, quantiles: int, clear_cache: bool = False):
+def generate_global_ranks(path: str, chunk_size: int = 100000, counts_dir: str = None):
+    """
+    Builds the global ranks of all the tables, saving the value counts of every table in counts_dir (if given) so
+    that load_dataset does not read the tables again. Returns the names of the saved tables in the order they were read.
+    """
+    table_names = list()
+    build_global_ranks(spill_tables(path, chunk_size, counts_dir, table_names), 'cache/global_ranks', tmp_dir='cache')
+    return table_names
+
+
+def spill_tables(path: str, chunk_size: int, counts_dir: str, table_names: list):
+    """Yields the distinct values of every column of the tables, saving the value counts of each table in counts_dir"""
+    if counts_dir is not None and not os.path.exists(counts_dir):
+        os.makedirs(counts_dir)
+    for table_name, columns in read_tables(path, chunk_size):
+        if counts_dir is not None:
+            with open(os.path.join(counts_dir, str(len(table_names)) + '.pkl'), 'wb') as output:
+                pickle.dump((table_name, columns), output, pickle.HIGHEST_PROTOCOL)
+            table_names.append(table_name)
+        for counts, _ in columns.values():
+            yield counts.index
+
+
+def read_spilled_tables(counts_dir: str, table_names: list):
+    """Yields the value counts of the tables saved by spill_tables one table at a time, deleting their files"""
+    for i in range(len(table_names)):
+        file = os.path.join(counts_dir, str(i) + '.pkl')
+        with open(file, 'rb') as pkl_file:
+            yield pickle.load(pkl_file)
+        os.remove(file)
+
+
+def load_dataset(path: str, threshold1: float, threshold2, quantiles: int, clear_cache: bool = False,
+                 emd_backend: str = 'pyemd', chunk_size: int = 100000, prune: bool = False, solver: str = 'auto',
+                 checkpoint_dir: str = None, histogram_cache_size: int = None):
     """
     Loads the TPCH dataset to the correlation clustering algorithm mentioned in
     "Automatic Discovery of Attributes in Relational Databases" [1]
@@ -77,18 +65,36 @@ def load_dataset(path: str, threshold1: float, threshold2, quantiles: int, clear
             the process pool that will be used in the pre-processing of the table's columns
     clear_cache: bool
             if true it clears the global ranks
+    emd_backend: str, optional
+            the EMD engine, one of emd_utils.EMD_BACKENDS (default is 'pyemd')
+    chunk_size: int, optional
+            the number of rows of a csv file read at once (default is 100000)
+    prune: bool, optional
+            skip the column combinations whose EMD is provably above threshold1 (default is False)
+    solver: str, optional
+            the correlation clustering solver, one of correlation_solvers.SOLVERS (default is 'auto')
+    checkpoint_dir: str, optional
+            the folder of the checkpoints of the pipeline stages, None disables them (default is None)
+    histogram_cache_size: int, optional
+            the size in bytes of the histogram cache in cache/histograms, None disables it (default is None)
     Returns
     -------
     CorrelationClustering
         the correlation clustering object with the data loaded
     """
+    # the tables are read once, one at a time. Their value counts are kept on disk until the global ranks of all of
+    # them are computed and then ranked from there
     if clear_cache:
-        generate_global_ranks(path)
-
-    cc = CorrelationClustering(quantiles, threshold1, threshold2)
-    for root, dirs, files in os.walk(os.path.join(path)):
-        for file in files:
-            cc.add_data(pd.read_csv(root + "/" + file, index_col=False).fillna(0), str(file.split(".")[0]))
+        table_names = generate_global_ranks(path, chunk_size, 'cache/value_counts')
+        tables = read_spilled_tables('cache/value_counts', table_names)
+    else:
+        tables = read_tables(path, chunk_size)
+
+    histogram_cache = HistogramCache(max_size=histogram_cache_size) if histogram_cache_size is not None else None
+    cc = CorrelationClustering(quantiles, threshold1, threshold2, emd_backend, prune, solver,
+                               checkpoint_dir, histogram_cache=histogram_cache)
+    for table_name, columns in tables:
+        cc.add_value_counts(columns, table_name)
     return cc
 
 
@@ -97,11 +103,11 @@ def create_cache_dirs():
         os.makedirs('cache')
     if not os.path.exists('cache/global_ranks'):
         os.makedirs('cache/global_ranks')
-    if not os.path.exists('cache/sorts'):
-        os.makedirs('cache/sorts')
 
 
-def get_results(path: str, threshold1: float, threshold2: float, quantiles: int, clear_cache: bool = True):
+def get_results(path: str, threshold1: float, threshold2: float, quantiles: int, clear_cache: bool = True,
+                emd_backend: str = 'pyemd', processes: int = 1, prune: bool = False, solver: str = 'auto',
+                checkpoint_dir: str = None, histogram_cache_size: int = None):
     """
     Runs the Schema Matching pipeline described in
     "Automatic Discovery of Attributes in Relational Databases" [1]
@@ -116,19 +122,30 @@ def get_results(path: str, threshold1: float, threshold2: float, quantiles: int,
          The global threshold described in [1]
     quantiles: int
         The number of quantiles that the histograms are split on
-    # process_pool: multiprocessing.Pool
-    #         the process pool that will be used in the pre-processing of the table's columns
-    # chunk_size: int, optional
-    #         the number of chunks of each job process (default let the framework decide)
     clear_cache: bool, optional
             clear the previous global ranks
+    emd_backend: str, optional
+            the EMD engine, one of emd_utils.EMD_BACKENDS (default is 'pyemd')
+    processes: int, optional
+            the number of worker processes that compute the EMD, None uses all the cores (default is 1)
+    prune: bool, optional
+            skip the column combinations whose EMD is provably above threshold1 (default is False)
+    solver: str, optional
+            the correlation clustering solver, one of correlation_solvers.SOLVERS (default is 'auto')
+    checkpoint_dir: str, optional
+            the folder of the checkpoints of the pipeline stages, e.g. 'cache/checkpoints', None disables them
+            (default is None)
+    histogram_cache_size: int, optional
+            the size in bytes of the histogram cache in cache/histograms, None disables it (default is None)
     """
     create_cache_dirs()
 
-    correlation_clustering = load_dataset(path, threshold1, threshold2, quantiles, clear_cache=clear_cache)
+    correlation_clustering = load_dataset(path, threshold1, threshold2, quantiles, clear_cache=clear_cache,
+                                          emd_backend=emd_backend, prune=prune, solver=solver,
+                                          checkpoint_dir=checkpoint_dir, histogram_cache_size=histogram_cache_size)
     print("DATA LOADED")
 
-    correlation_clustering.find_matches()
+    correlation_clustering.find_matches(processes)
 
 
 if __name__ == "__main__":
@@ -137,9 +154,11 @@ if __name__ == "__main__":
     argv[2] -> the global threshold
     argv[4] -> the number of quantiles 
     argv[5] -> clear cache or not
+    argv[6] -> the number of worker processes (optional, default is 1)
 
-    e.g. python3 run_tpch_benchmark.py ../data/clustering/ 0.1 0.1 50 True
+    e.g. python3 run_tpch_benchmark.py ../data/clustering/ 0.1 0.1 50 True 8
     """
     get_results(sys.argv[1], threshold1=float(sys.argv[2]), threshold2=float(sys.argv[2]),
-                quantiles=int(sys.argv[4]), clear_cache=bool(sys.argv[5]))
+                quantiles=int(sys.argv[4]), clear_cache=bool(sys.argv[5]),
+                processes=int(sys.argv[6]) if len(sys.argv) > 6 else 1)
     # get_results("./data/clustering/paper/", threshold1=0.1, threshold2=0.1, quantiles=50, clear_cache=True)
@@ -0,0 +1,35 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from algorithms.clustering.correlation_clustering import CorrelationClustering
+
+
+@pytest.fixture
+def dataset(tmp_path, monkeypatch):
+    """
+    Writes a small database of 4 tables in tmp_path/data and runs the test in tmp_path, so that the cache folder of
+    the pipeline is created there. The clusters written by find_matches are kept in the returned dict instead of the
+    JSON files of the repository.
+    """
+    rng = np.random.default_rng(0)
+    names = np.array(['alpha', 'beta', 'gamma', 'delta', 'eps', 'zeta', 'eta', 'theta'])
+    (tmp_path / 'data').mkdir()
+    for t in range(4):
+        n = 200 + 50 * t
+        table = pd.DataFrame({'id': np.arange(n) + 10 * t,
+                              'price': np.round(rng.normal(100, 10, n), 2),
+                              'qty': rng.integers(1, 50, n),
+                              'name': rng.choice(names[:4 + t], n),
+                              'code': ['C' + str(x) for x in rng.integers(0, 30, n)]})
+        if t % 2:
+            table['flag'] = rng.integers(0, 2, n)
+        table.to_csv(str(tmp_path / 'data' / ('t' + str(t) + '.csv')), index=False)
+    monkeypatch.chdir(tmp_path)
+
+    clusters = dict()
+
+    def write_clusters(found, file_name):
+        clusters[file_name] = sorted(sorted(cluster) for cluster in found)
+    monkeypatch.setattr(CorrelationClustering, 'write_clusters_to_json', staticmethod(write_clusters))
+    return str(tmp_path / 'data'), clusters
@@ -0,0 +1,43 @@
+import os
+
+import pytest
+
+import algorithms.clustering.discovery as discovery
+from experiments.clustering_experiments import create_cache_dirs, load_dataset
+
+
+def find_matches(path, checkpoint_dir=None, clear_cache=True):
+    create_cache_dirs()
+    load_dataset(path, 0.1, 0.1, 50, clear_cache=clear_cache, checkpoint_dir=checkpoint_dir).find_matches()
+
+
+def test_resume_after_a_crash_in_the_solver(dataset, monkeypatch):
+    path, clusters = dataset
+    find_matches(path)
+    expected = dict(clusters)
+
+    solve = discovery.solve_correlation_clustering
+    solved = list()
+
+    def crash_on_second_cluster(*args):
+        if len(solved) == 1:
+            raise RuntimeError('crash')
+        solved.append(args[0])
+        return solve(*args)
+    monkeypatch.setattr(discovery, 'solve_correlation_clustering', crash_on_second_cluster)
+    with pytest.raises(RuntimeError):
+        find_matches(path, 'checkpoints', clear_cache=False)
+    saved = sorted(name.split('-')[0] for name in os.listdir('checkpoints'))
+    assert saved == ['attribute_cluster', 'distribution_clusters', 'emd_matrix']
+
+    resumed = list()
+
+    def record(*args):
+        resumed.append(args[0])
+        return solve(*args)
+    monkeypatch.setattr(discovery, 'solve_correlation_clustering', record)
+    clusters.clear()
+    find_matches(path, 'checkpoints', clear_cache=False)
+
+    assert clusters == expected
+    assert solved[0] not in resumed and len(resumed) > 0
@@ -0,0 +1,24 @@
+import numpy as np
+
+import algorithms.clustering.discovery as discovery
+from algorithms.clustering.column_store import ColumnStore
+from algorithms.clustering.utils import worker_store_argument
+from experiments.clustering_experiments import create_cache_dirs, load_dataset
+
+
+def test_saved_store_is_memory_mapped_by_the_workers(dataset):
+    path, _ = dataset
+    create_cache_dirs()
+    columns = load_dataset(path, 0.1, 0.1, 50, clear_cache=True).columns
+    store = ColumnStore.from_cache(columns)
+    store.save('store')
+    saved = ColumnStore.load('store')
+
+    assert isinstance(saved.ranks, np.memmap)
+    assert saved.fingerprint() == store.fingerprint()
+    assert worker_store_argument(store) == 'store' and worker_store_argument(saved) == 'store'
+    assert isinstance(worker_store_argument(ColumnStore.from_cache(columns)), ColumnStore)
+
+    A = discovery.compute_emd_matrix(columns, 0.1, 50, store=ColumnStore.from_cache(columns))
+    pooled = discovery.compute_emd_matrix(columns, 0.1, 50, processes=2, store=saved)
+    assert np.array_equal(A, pooled)
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+from scipy import sparse
+
+from algorithms.clustering.correlation_solvers import disagreements, ilp_correlation_clustering, pair_weights, \
+    pivot_correlation_clustering, solve_correlation_clustering
+
+
+def partitions(n):
+    """All the clusterings of n vertexes as restricted growth strings"""
+    if n == 0:
+        yield []
+        return
+    for labels in partitions(n - 1):
+        for label in range(max(labels, default=-1) + 2):
+            yield labels + [label]
+
+
+def random_graph(rng, n, density):
+    graph = rng.random((n, n)) < density
+    np.fill_diagonal(graph, False)
+    return sparse.csr_matrix(graph)
+
+
+def same_clusters(labels1, labels2):
+    return np.array_equal(labels1[:, None] == labels1[None, :], labels2[:, None] == labels2[None, :])
+
+
+@pytest.mark.parametrize('seed', range(6))
+def test_ilp_finds_the_fewest_disagreements(seed):
+    rng = np.random.default_rng(seed)
+    for n in range(2, 7):
+        weights = pair_weights(random_graph(rng, n, rng.uniform(0.2, 0.8)))
+        best = min(disagreements(np.array(labels), weights) for labels in partitions(n))
+
+        ilp = ilp_correlation_clustering(weights)
+        pivot = pivot_correlation_clustering(weights)
+        assert disagreements(ilp, weights) == best
+        assert best <= disagreements(pivot, weights)
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_pivot_matches_ilp_on_disjoint_cliques(seed):
+    rng = np.random.default_rng(seed)
+    labels = rng.integers(0, 3, 8)
+    graph = sparse.csr_matrix((labels[:, None] == labels[None, :]) & ~np.eye(8, dtype=bool))
+    weights = pair_weights(graph)
+
+    assert same_clusters(ilp_correlation_clustering(weights), labels)
+    assert same_clusters(pivot_correlation_clustering(weights), labels)
+    vertexes = list(range(8))
+    assert np.array_equal(solve_correlation_clustering(vertexes, graph, 'ilp'),
+                          solve_correlation_clustering(vertexes, graph, 'pivot'))
@@ -0,0 +1,32 @@
+import numpy as np
+
+import algorithms.clustering.discovery as discovery
+from algorithms.clustering.column_store import ColumnStore
+from experiments.clustering_experiments import create_cache_dirs, load_dataset
+
+
+def load_columns(path):
+    create_cache_dirs()
+    columns = load_dataset(path, 0.1, 0.1, 50, clear_cache=True).columns
+    return columns, ColumnStore.from_cache(columns)
+
+
+def test_attribute_clusters_in_a_pool_match_serial(dataset, monkeypatch):
+    path, _ = dataset
+    columns, store = load_columns(path)
+    distribution_clusters = [DC for DC in discovery.compute_distribution_clusters(columns, 0.1, 50, store=store)
+                             if len(DC) > 1]
+
+    large_clusters = discovery.large_clusters
+    large = list()
+
+    def record_large_clusters(sizes, processes):
+        large.extend(large_clusters(sizes, processes))
+        return np.array(large, dtype=np.int64)
+    monkeypatch.setattr(discovery, 'large_clusters', record_large_clusters)
+
+    serial = discovery.compute_attribute_clusters(distribution_clusters, 0.1, 50, store=store)
+    pooled = discovery.compute_attribute_clusters(distribution_clusters, 0.1, 50, processes=2, store=store)
+
+    assert len(large) > 0
+    assert [result.tolist() for result in serial] == [result.tolist() for result in pooled]
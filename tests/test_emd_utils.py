@@ -0,0 +1,55 @@
+import math
+from collections import Counter
+
+import numpy as np
+import pytest
+from pyemd import emd
+
+from algorithms.clustering.column_store import ColumnStore
+from algorithms.clustering.quantile_histogram.histogram import QuantileHistogram
+from algorithms.clustering.utils import column_combinations, compute_emd
+from experiments.clustering_experiments import create_cache_dirs, load_dataset
+
+
+def pair_emd(histogram, ranks, size):
+    """The EMD of one pair of columns as the original quantile_emd computed it"""
+    other = QuantileHistogram('other', ranks, size, histogram.quantiles, reference_hist=histogram)
+    if other.is_empty:
+        return math.inf
+    return emd(histogram.get_values, other.get_values, histogram.dist_matrix)
+
+
+def pair_intersection_emd(histogram1, ranks1, histogram2, ranks2):
+    """The intersection EMD of one pair of columns over the multiset of their common values"""
+    common = set(ranks1.tolist()) & set(ranks2.tolist())
+    if not common:
+        return math.inf
+    counts = Counter(r for r in ranks1.tolist() + ranks2.tolist() if r in common)
+    intersection = np.sort(np.array(list(counts.elements()), dtype=ranks1.dtype))
+    return (pair_emd(histogram1, intersection, len(intersection)) +
+            pair_emd(histogram2, intersection, len(intersection))) / 2
+
+
+@pytest.mark.parametrize('backend', ['pyemd', 'cumsum'])
+@pytest.mark.parametrize('intersection', [False, True])
+def test_emd_matrix_matches_pairwise_emd(dataset, backend, intersection):
+    path, _ = dataset
+    create_cache_dirs()
+    columns = load_dataset(path, 0.1, 0.1, 50, clear_cache=True).columns
+    store = ColumnStore.from_cache(columns)
+    ids = np.array([store.index(name) for name in columns], dtype=np.int64)
+    rows = list(column_combinations(columns))
+
+    A = compute_emd(rows, ids, store, intersection, backend)
+    pooled = compute_emd(rows, ids, store, intersection, backend, processes=2)
+
+    assert np.array_equal(A, pooled)
+    for i, js in rows:
+        for j in js:
+            if intersection:
+                expected = pair_intersection_emd(store.get_histogram(ids[i]), store.get_ranks(ids[i]),
+                                                 store.get_histogram(ids[j]), store.get_ranks(ids[j]))
+            else:
+                expected = pair_emd(store.get_histogram(ids[i]), store.get_ranks(ids[j]), store.get_size(ids[j]))
+            assert A[i, j] == A[j, i]
+            assert A[i, j] == pytest.approx(expected, rel=1e-5, abs=1e-6)
@@ -0,0 +1,66 @@
+import os
+import shutil
+import subprocess
+
+import numpy as np
+import pytest
+
+from algorithms.clustering.global_ranks import build_global_ranks, compute_global_ranks, get_rank_index, \
+    rank_index_version, update_global_ranks
+
+VALUES = [[1, 1.0, '1', '1-x', 2.5, '2.5', 10, '10-x', 1e20],
+          [10 ** 20, 1.0, -3, '-3a', '.5', 0.5, 'abc', '', ' 7'],
+          [2, 2.0, 'é', '日本', '-', 'abc', -0.0, 0, '1.0']]
+
+
+def distinct_values(batches):
+    values = set()
+    for batch in batches:
+        values.update(batch)
+    return values
+
+
+@pytest.mark.parametrize('run_size', [1, 2, 5, 1000])
+def test_build_global_ranks_matches_compute_global_ranks(tmp_path, run_size):
+    index = build_global_ranks(VALUES, str(tmp_path / 'global_ranks'), run_size=run_size)
+    expected = compute_global_ranks(distinct_values(VALUES))
+
+    assert len(index) == len(expected)
+    assert index.fingerprint() == expected.fingerprint()
+    values = [value for batch in VALUES for value in batch]
+    assert np.array_equal(index.lookup(values), expected.lookup(values))
+
+
+@pytest.mark.skipif(shutil.which('sort') is None, reason='needs the sort command')
+def test_compute_global_ranks_matches_sort_n(tmp_path):
+    values = [1, '1-x', 2.5, '10-x', 1e20, 10 ** 20, -3, '-3a', '.5', 0.75, 'abc', '', ' 7', 'é', '日本', '-', -0.0,
+              0, '1.0x', '007', 'B', 'b', '1e5']
+    path = tmp_path / 'values.txt'
+    path.write_text(''.join(str(value) + '\n' for value in values), encoding='utf-8')
+    output = subprocess.run(['sort', '-n', str(path)], stdout=subprocess.PIPE, check=True,
+                            env=dict(os.environ, LC_ALL='C')).stdout.decode('utf-8')
+
+    index = compute_global_ranks(values)
+
+    assert [index.text(i) for i in range(len(index))] == output.splitlines()
+
+
+def test_inserts_into_the_same_gap_rank_the_values_anew(tmp_path):
+    path = str(tmp_path / 'global_ranks')
+    values = ['a', 'b', 3]
+    update_global_ranks(values, path)
+    versions = [rank_index_version(path)]
+    for k in range(1, 80):
+        # every value is sorted right after the previous one, so the gap before 'b' is split in two every time
+        values.append('a' + 'm' * k)
+        update_global_ranks(values[-1:], path)
+        versions.append(rank_index_version(path))
+        index = get_rank_index(path)
+        assert np.all(np.diff(index.ranks) > 0)
+
+    changed = [k for k in range(1, len(versions)) if versions[k] != versions[k - 1]]
+    assert len(changed) > 0 and changed[0] > 40
+    # the values ranked anew have the ranks of a full build, which is a new version
+    assert versions[changed[0]] == compute_global_ranks(values[:changed[0] + 3]).fingerprint()
+    ranks = get_rank_index(path).lookup(values)
+    assert np.array_equal(np.argsort(ranks), np.argsort(compute_global_ranks(values).lookup(values)))
@@ -0,0 +1,32 @@
+import pandas as pd
+
+from algorithms.clustering.global_ranks import compute_global_ranks, rank_index_version, update_global_ranks
+from algorithms.clustering.histogram_cache import HistogramCache, content_hash
+from algorithms.clustering.utils import process_value_counts
+
+
+def test_content_hash_tells_the_types_apart():
+    assert content_hash(pd.Series([0, 1]), 'object') != content_hash(pd.Series(['0', '1']), 'object')
+    assert content_hash(pd.Series([3, 2], index=[0, 1]), 'object', index=True) != \
+        content_hash(pd.Series([3, 2], index=['0', '1']), 'object', index=True)
+
+
+def test_inserted_values_keep_the_cached_histograms(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    compute_global_ranks(['a', 'b', 'c', 1, 2]).save()
+    cache = HistogramCache(str(tmp_path / 'histograms'))
+    counts = pd.Series([2, 1, 3], index=['a', 'c', 1])
+
+    process_value_counts(('column', counts, 'table', 'object', 4, cache))
+    version = rank_index_version()
+    update_global_ranks(['b2', 1.5, 'z'])
+    process_value_counts(('column', counts, 'table', 'object', 4, cache))
+
+    assert rank_index_version() == version
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    compute_global_ranks(['a', 'b', 'c', 1, 2, 'b2']).save()
+    process_value_counts(('column', counts, 'table', 'object', 4, cache))
+
+    assert rank_index_version() != version
+    assert (cache.hits, cache.misses) == (1, 2)
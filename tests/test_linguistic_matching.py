@@ -0,0 +1,77 @@
+import itertools
+import zlib
+
+import pytest
+
+import algorithms.cupid.linguistic_matching as lm
+from algorithms.cupid.cupid_model import Cupid
+from algorithms.cupid.tree_match import tree_match
+from algorithms.cupid.wordnet_cache import WordNetCache
+
+SOURCE = ['EmployeeID', 'FirstName', 'LastName', 'Title', 'EmailName', 'Extension', 'Workphone', 'home_address',
+          'city', 'PostalCode', 'OrderId', 'Amount', 'ship_city']
+TARGET = ['EmployeeIdFk', 'TeritoryId', 'first_name', 'surname', 'Address', 'zip', 'Phone', 'purchase_id',
+          'total amount', 'City']
+
+
+class FakeStopwords(object):
+    @staticmethod
+    def words(language):
+        return ['the', 'of', 'a', 'id']
+
+
+class FakeWordNet(object):
+    """A deterministic stand-in for the WordNet corpus, which is not downloaded with nltk"""
+
+    @staticmethod
+    def synsets(word):
+        h = zlib.crc32(word.lower().encode('utf-8'))
+        return [word.lower() + str(k) for k in range(h % 3)]
+
+    @staticmethod
+    def wup_similarity(synset1, synset2):
+        if synset1[:-1] == synset2[:-1]:
+            return 1.0
+        return (zlib.crc32((min(synset1, synset2) + max(synset1, synset2)).encode('utf-8')) % 100) / 100
+
+
+@pytest.fixture
+def wordnet(monkeypatch):
+    monkeypatch.setattr(lm, 'wn', FakeWordNet)
+    monkeypatch.setattr(lm, 'stopwords', FakeStopwords)
+    monkeypatch.setattr(lm, 'tokenizer', 'regex')
+    monkeypatch.setattr(lm.nltk, 'word_tokenize', lambda text: lm.tokenize(text, 'regex'))
+    monkeypatch.setattr(lm, 'wordnet_cache', WordNetCache())
+    for cached in (lm.english_stopwords, lm.normalized_tokens, lm.get_synsets):
+        cached.cache_clear()
+    yield
+    lm.clear_vocabulary()
+    for cached in (lm.english_stopwords, lm.normalized_tokens, lm.get_synsets):
+        cached.cache_clear()
+
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_vocabulary_matches_token_similarity(wordnet, processes):
+    elements = [lm.normalization(name) for name in SOURCE + TARGET]
+    expected = [[lm.name_similarity_elements(e1, e2) for e2 in elements] for e1 in elements]
+    tokens = {token for element in elements for token in element.get_tokens_data()}
+
+    lm.build_vocabulary(tokens, processes)
+    assert set(lm.vocabulary_index) == tokens
+    for word1, word2 in itertools.product(tokens, repeat=2):
+        assert lm.vocabulary_matrix[lm.vocabulary_index[word1], lm.vocabulary_index[word2]] == \
+            lm.token_similarity(word1, word2)
+    assert [[lm.name_similarity_elements(e1, e2) for e2 in elements] for e1 in elements] == expected
+
+
+def test_tree_match_in_a_pool_matches_serial(wordnet):
+    cupid = Cupid()
+    cupid.add_data('s1', 'employee', zip(SOURCE, itertools.cycle(['string', 'int', 'varchar'])))
+    cupid.add_data('s2', 'employee-territory', zip(TARGET, itertools.cycle(['str', 'integer'])))
+    source, target = cupid.get_schema_by_name('s1'), cupid.get_schema_by_name('s2')
+
+    serial = tree_match(source, target, cupid.get_categories())
+    assert len(lm.vocabulary_index) == 0
+    pooled = tree_match(source, target, cupid.get_categories(), processes=2)
+    assert len(lm.vocabulary_index) == 0
+    assert len(serial) > 0 and serial == pooled